@@ -1,5 +1,5 @@
-import yaml
 from scservo_sdk import PortHandler, PacketHandler, COMM_SUCCESS
+from config import load_config, ConfigError
 from servo_constants import (
     PROTOCOL_VERSION, BAUDRATE, SO101_MOTORS, 
     ADDR_ID
@@ -53,8 +53,7 @@ def setup_motors(port):
 
 def main():
     try:
-        with open(".env.yaml", "r") as f:
-            config = yaml.safe_load(f)
+        config = load_config(".env.yaml")
 
         print("セットアップするアームを選択してください:")
         print("1. フォロワーアーム")
@@ -76,8 +75,8 @@ def main():
     except FileNotFoundError:
         print(".env.yaml が見つかりません")
         return
-    except KeyError:
-        print(".env.yaml の設定形式が無効です")
+    except (KeyError, ConfigError) as e:
+        print(f".env.yaml の設定形式が無効です: {e}")
         return
 
 
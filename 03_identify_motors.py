@@ -1,5 +1,5 @@
-import yaml
 from scservo_sdk import PortHandler, PacketHandler, COMM_SUCCESS
+from config import load_config, ConfigError
 from servo_constants import (
     PROTOCOL_VERSION, BAUDRATE, ADDR_ID
 )
@@ -40,8 +40,7 @@ def identify_motors(port):
 
 def main():
     try:
-        with open(".env.yaml", "r") as f:
-            config = yaml.safe_load(f)
+        config = load_config(".env.yaml")
 
         print("=== フォロワーアーム ===")
         follower_port = config["follower"]["port"]
@@ -56,8 +55,8 @@ def main():
     except FileNotFoundError:
         print(".env.yaml が見つかりません")
         return
-    except KeyError:
-        print(".env.yaml の設定形式が無効です")
+    except (KeyError, ConfigError) as e:
+        print(f".env.yaml の設定形式が無効です: {e}")
         return
 
 
@@ -1,23 +1,19 @@
-import yaml
-import scservo_sdk as scs
+from bus import ServoBus
+from config import load_config, arm_configs, arm_section, update_joint_calibration
 from servo_constants import (
-    PROTOCOL_VERSION, BAUDRATE, SO101_MOTORS,
+    SO101_MOTORS,
     ADDR_TORQUE_ENABLE, ADDR_LOCK, ADDR_HOMING_OFFSET, ADDR_PRESENT_POSITION
 )
 from time import sleep
 import select
 import sys
 
-with open('.env.yaml', 'r') as f:
-    config = yaml.safe_load(f)
+config = load_config('.env.yaml')
 
-packet_handler = scs.PacketHandler(PROTOCOL_VERSION)
-
-def port_reconnect(port_handler):
+def port_reconnect(bus):
     sleep(0.1)
-    port_handler.closePort()
-    port_handler.openPort()
-    port_handler.setBaudRate(BAUDRATE)
+    bus.close()
+    bus.open()
     return None
 
 def calibrate_arm(arm_name, port_path):
@@ -30,45 +26,57 @@ def calibrate_arm(arm_name, port_path):
         print(f"{arm_name}アームのキャリブレーションをスキップしました")
         return
     
-    port_handler = scs.PortHandler(port_path)
-    port_handler.openPort()
-    port_handler.setBaudRate(BAUDRATE)
+    bus = ServoBus(port_path)
+    if not bus.open():
+        print(f"ポート {port_path} を開けませんでした: {bus.last_error}")
+        return
     
     # Initialize calibration config if not exists
-    if 'calibration' not in config[arm_name]:
-        config[arm_name]['calibration'] = {}
-        for motor_name in SO101_MOTORS.keys():
-            config[arm_name]['calibration'][motor_name] = {'id': SO101_MOTORS[motor_name]}
+    # (途中で止まった前回の結果にない関節も ID から始められるよう、モーターごとに補う)
+    arm_config = arm_section(config, arm_name)
+    arm_config.setdefault('calibration', {})
+    for motor_name in SO101_MOTORS.keys():
+        arm_config['calibration'].setdefault(motor_name, {'id': SO101_MOTORS[motor_name]})
     
     for motor_name, motor_id in SO101_MOTORS.items():
-        packet_handler.write1ByteTxRx(port_handler, motor_id, ADDR_TORQUE_ENABLE, 0)
-        packet_handler.write1ByteTxRx(port_handler, motor_id, ADDR_LOCK, 0)
+        bus.write1(motor_id, ADDR_TORQUE_ENABLE, 0)
+        bus.write1(motor_id, ADDR_LOCK, 0)
 
     try:
         for motor_name in SO101_MOTORS.keys():
-            motor_id = config[arm_name]['calibration'][motor_name]['id']
+            motor_id = arm_config['calibration'][motor_name]['id']
             print(f"\n=== {motor_name} (ID: {motor_id}) のキャリブレーション ===")
             print(f"{motor_name} を中間位置にセットしたら Enter を押してください")
             while input() != "":
                 print("Enterキーを押してください")
                 continue
-            packet_handler.write2ByteTxRx(port_handler, motor_id, ADDR_HOMING_OFFSET, 0)
-            port_reconnect(port_handler)
-            now_pos, _, _ = packet_handler.read2ByteTxRx(port_handler, motor_id, ADDR_PRESENT_POSITION)
-            optimized_offset = now_pos - 2047
-            packet_handler.write2ByteTxRx(port_handler, motor_id, ADDR_HOMING_OFFSET, optimized_offset)
-            port_reconnect(port_handler)
+            result = bus.write2(motor_id, ADDR_HOMING_OFFSET, 0)
+            port_reconnect(bus)
+            now_pos = bus.read2(motor_id, ADDR_PRESENT_POSITION) if result.ok else result
+            if not now_pos.ok:
+                # 読み出せないまま進むと誤ったオフセットが EEPROM と .env.yaml に書き込まれるため、この関節は中断する
+                print(f"{motor_name} を読み出せないためキャリブレーションを中断しました: {bus.describe(now_pos)}")
+                print("配線を確認してから 04_calibrate.py をもう一度実行してください")
+                continue
+            optimized_offset = now_pos.value - 2047
+            result = bus.write2(motor_id, ADDR_HOMING_OFFSET, optimized_offset)
+            port_reconnect(bus)
+            if not result.ok:
+                print(f"{motor_name} のオフセットを書き込めないためキャリブレーションを中断しました: {bus.describe(result)}")
+                continue
 
             min_pos = 4095
             max_pos = 0
             while True:
-                pos, _, _ = packet_handler.read2ByteTxRx(port_handler, motor_id, ADDR_PRESENT_POSITION)
-                min_pos = min_pos if pos > min_pos else pos
-                max_pos = max_pos if pos < max_pos else pos
+                pos = bus.read2(motor_id, ADDR_PRESENT_POSITION).value
+                # 読み出しに失敗したサンプルは最小・最大に含めない
+                if pos is not None:
+                    min_pos = min_pos if pos > min_pos else pos
+                    max_pos = max_pos if pos < max_pos else pos
                 print("\033[2J\033[H", end="") 
                 print(f"=== {motor_name} を限界まで動かして最小と最大値を定義します ===")
                 print( f"オフセット: {optimized_offset}")
-                print( f"現在値: {pos}")
+                print( f"現在値: {pos if pos is not None else '読み出し失敗'}")
                 print( f"最小値: {min_pos}")
                 print( f"最大値: {max_pos}")
                 print("Enterキーで次のモーターへ")
@@ -77,31 +85,37 @@ def calibrate_arm(arm_name, port_path):
                     if user_input == "":
                         break
             
-            config[arm_name]['calibration'][motor_name]['homing_offset'] = optimized_offset
-            config[arm_name]['calibration'][motor_name]['range_min'] = min_pos
-            config[arm_name]['calibration'][motor_name]['range_max'] = max_pos
+            if min_pos > max_pos:
+                print(f"{motor_name} の可動範囲を読み出せなかったため保存しませんでした")
+                continue
+            
+            # 途中で落ちても終わった関節の結果が残るよう、1 関節ごとに .env.yaml に書き込む
+            update_joint_calibration(arm_name, motor_name, {
+                'id': motor_id,
+                'homing_offset': optimized_offset,
+                'range_min': min_pos,
+                'range_max': max_pos,
+            }, '.env.yaml')
             
-            print(f"{motor_name} のキャリブレーション完了")
+            print(f"{motor_name} のキャリブレーション完了 - .env.yamlに保存しました")
         
         print(f"\n{arm_name}アームのキャリブレーション完了")
 
     except Exception as e:
         print(f"エラー: {e}")
     finally:
-        port_handler.closePort()
+        bus.close()
 
 
 def main():
     try:
-        # フォロワーアームのキャリブレーション
-        calibrate_arm('follower', config['follower']['port'])
+        # フォロワーアーム (arms がある場合は全アーム) のキャリブレーション
+        for arm_name, arm_config in arm_configs(config).items():
+            calibrate_arm(arm_name, arm_config['port'])
         
         # リーダーアームのキャリブレーション
-        calibrate_arm('leader', config['leader']['port'])
-        
-        # 設定を保存
-        with open('.env.yaml', 'w') as f:
-            yaml.dump(config, f, default_flow_style=False)
+        if 'leader' in config:
+            calibrate_arm('leader', config['leader']['port'])
         
         print("\n" + "="*50)
         print("全アームのキャリブレーション完了 - .env.yamlに保存しました")
@@ -1,87 +1,109 @@
 #!/usr/bin/env python3
 # シンプルなロボットアーム制御GUI
 
-import yaml
 import tkinter as tk
 from tkinter import ttk
-import threading
-import time
 import signal
 import sys
-from scservo_sdk import PortHandler, PacketHandler
 from servo_constants import (
-    PROTOCOL_VERSION, BAUDRATE,
     ADDR_TORQUE_ENABLE, ADDR_PRESENT_POSITION, ADDR_GOAL_POSITION,
     ADDR_POSITION_P_GAIN, ADDR_POSITION_I_GAIN, ADDR_POSITION_D_GAIN, 
     ADDR_OPERATING_MODE,
 )
+from config import load_arms, ConfigError, DEFAULT_ARM
+from bus import ServoBus
+from state import StateService
+from protection import ProtectionMonitor, BusJoint
+from estop import EmergencyStop, default_socket_path
 
 class SimpleRobotGUI:
-    def __init__(self):
-        # 設定ファイル読み込み
-        with open('.env.yaml', 'r') as f:
-            self.config = yaml.safe_load(f)
+    def __init__(self, arm_name=DEFAULT_ARM):
+        # 設定ファイル読み込み (検証・コンパイル済み)
+        self.arm_name = arm_name
+        self.arm_config, self.calibration = load_arms()[arm_name]
+        if self.calibration is None:
+            raise ConfigError(f"{arm_name} のキャリブレーションが終わっていません。04_calibrate.py を実行してください")
         
-        self.motor_order = sorted(
-            self.config['follower']['calibration'].keys(),
-            key=lambda motor_name: self.config['follower']['calibration'][motor_name]['id']
-        )
+        self.motor_order = list(self.calibration.names)
+        self.motor_ids = self.calibration.motor_ids()
         
         # ポート接続
-        self.portHandler = PortHandler(self.config['follower']['port'])
-        self.packetHandler = PacketHandler(PROTOCOL_VERSION)
-        self.portHandler.openPort()
-        self.portHandler.setBaudRate(BAUDRATE)
+        self.bus = ServoBus(self.arm_config['port'])
+        if not self.bus.open():
+            print(f"ポート {self.bus.port} を開けませんでした。再接続を試みます")
         
         # 全モーターのトルク状態を管理
         self.motor_torque_enabled = {}
         
         for motor_name in self.motor_order:
-            motor_id = self.config['follower']['calibration'][motor_name]['id']
-            self.packetHandler.write1ByteTxRx(self.portHandler, motor_id, ADDR_OPERATING_MODE, 0)  # Position mode
+            motor_id = self.motor_ids[motor_name]
+            self.bus.write1(motor_id, ADDR_OPERATING_MODE, 0)  # Position mode
             
             # PID制御パラメータ設定
-            self.packetHandler.write1ByteTxRx(self.portHandler, motor_id, ADDR_POSITION_P_GAIN, 16)  # P_Coefficient
-            self.packetHandler.write1ByteTxRx(self.portHandler, motor_id, ADDR_POSITION_I_GAIN, 0)   # I_Coefficient  
-            self.packetHandler.write1ByteTxRx(self.portHandler, motor_id, ADDR_POSITION_D_GAIN, 32)  # D_Coefficient
+            self.bus.write1(motor_id, ADDR_POSITION_P_GAIN, 16)  # P_Coefficient
+            self.bus.write1(motor_id, ADDR_POSITION_I_GAIN, 0)   # I_Coefficient  
+            self.bus.write1(motor_id, ADDR_POSITION_D_GAIN, 32)  # D_Coefficient
             
             # 現在のトルク状態を取得
-            torque_status, _, _ = self.packetHandler.read1ByteTxRx(self.portHandler, motor_id, ADDR_TORQUE_ENABLE)
+            torque_status = self.bus.read1(motor_id, ADDR_TORQUE_ENABLE).value
             self.motor_torque_enabled[motor_name] = bool(torque_status)
         
+        # 状態 (位置・負荷・温度・トルク状態など) を動いている間だけ速い周期で取得し、変化した値だけ受け取る
+        self.state = StateService(
+            self.bus,
+            self.motor_ids,
+        )
+        self.motor_states = {motor_name: {} for motor_name in self.motor_order}
+        
+        # ストール・過熱を検出して自動で保護する (トルク状態と目標位置は GUI が書き込むたびに joints に反映する)
+        self.joints = {motor_name: BusJoint(self.bus, self.motor_ids[motor_name]) for motor_name in self.motor_order}
+        for motor_name, joint in self.joints.items():
+            joint.torque_enable = int(self.motor_torque_enabled[motor_name])
+        self.protection = ProtectionMonitor(self.joints)
+        self.state.telemetry.add_listener(self.on_sample)
+        
+        # 非常停止 (ボタン・SIGUSR1・UNIX ソケットへの接続で停止できる)
+        self.estop = EmergencyStop(
+            self.bus,
+            self.motor_ids,
+        )
+        self.estop.install_signal_handler()
+        self.estop.serve_socket(self.arm_config.get('estop_socket', default_socket_path(self.bus.port)))
+        
         # GUI作成
         self.create_gui()
         
-        # 更新スレッド開始
+        # 状態の取得開始
         self.running = True
-        self.update_thread = threading.Thread(target=self.update_loop)
-        self.update_thread.daemon = True
-        self.update_thread.start()
+        self.state.subscribe(self.on_state_change)
+        self.state.start()
         
         # Ctrl+C対応
         signal.signal(signal.SIGINT, self.signal_handler)
     
     def create_gui(self):
         self.root = tk.Tk()
-        self.root.title("Robot Control with Sliders")
-        self.root.geometry("700x450")
+        self.root.title(f"Robot Control with Sliders ({self.arm_name})")
+        self.root.geometry("1000x450")
         
         # 位置表示ラベルとスライダー
         self.position_labels = {}
         self.sliders = {}
         self.goal_labels = {}
+        self.telemetry_labels = {}
         
         for motor_name in self.motor_order:
             frame = ttk.Frame(self.root)
             frame.pack(fill='x', padx=10, pady=5)
             
-            motor_config = self.config['follower']['calibration'][motor_name]
-            range_min = motor_config.get('range_min', 0)
-            range_max = motor_config.get('range_max', 4095)
+            range_min, range_max = self.calibration.range_of(motor_name)
             
             # 現在位置を取得
-            motor_id = motor_config['id']
-            current_pos, _, _ = self.packetHandler.read2ByteTxRx(self.portHandler, motor_id, ADDR_PRESENT_POSITION)
+            motor_id = self.motor_ids[motor_name]
+            current_pos = self.bus.read2(motor_id, ADDR_PRESENT_POSITION).value
+            if current_pos is None:
+                # 読み出せない場合は可動範囲の中央を仮の表示値にする
+                current_pos = (range_min + range_max) // 2
             
             # スライダー行
             slider_frame = ttk.Frame(frame)
@@ -114,6 +136,11 @@ class SimpleRobotGUI:
             range_label = ttk.Label(slider_frame, text=f"({range_min}-{range_max})", width=15)
             range_label.pack(side='left', padx=(10, 0))
             
+            # テレメトリ表示 (負荷・温度・電圧・電流)
+            telemetry_label = ttk.Label(slider_frame, text="", width=34)
+            telemetry_label.pack(side='left', padx=(10, 0))
+            self.telemetry_labels[motor_name] = telemetry_label
+            
             # スライダーのcommandを設定
             slider.config(command=lambda val, name=motor_name: self.on_slider_change(name, val))
         
@@ -139,6 +166,13 @@ class SimpleRobotGUI:
         self.all_torque_status_label = ttk.Label(control_frame, text=status_text, foreground=status_color, font=('TkDefaultFont', 10, 'bold'))
         self.all_torque_status_label.pack(side='left', padx=(10, 0))
         
+        # 非常停止ボタン
+        estop_button = ttk.Button(control_frame, text="EMERGENCY STOP", command=self.emergency_stop, width=18)
+        estop_button.pack(side='left', padx=(30, 0))
+        
+        self.estop_label = ttk.Label(control_frame, text="", foreground='red')
+        self.estop_label.pack(side='left', padx=(10, 0))
+        
         # 終了時の処理
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
     
@@ -149,35 +183,64 @@ class SimpleRobotGUI:
         if all_torque_enabled:
             # 全モーターのトルクOFF
             for motor_name in self.motor_order:
-                motor_id = self.config['follower']['calibration'][motor_name]['id']
+                motor_id = self.motor_ids[motor_name]
                 # 現在位置を目標位置に設定してから無効化
-                current_pos, _, _ = self.packetHandler.read2ByteTxRx(self.portHandler, motor_id, ADDR_PRESENT_POSITION)
-                self.packetHandler.write2ByteTxRx(self.portHandler, motor_id, ADDR_GOAL_POSITION, current_pos)
-                self.packetHandler.write1ByteTxRx(self.portHandler, motor_id, ADDR_TORQUE_ENABLE, 0)
+                current_pos = self.bus.read2(motor_id, ADDR_PRESENT_POSITION).value
+                if current_pos is not None:
+                    self.bus.write2(motor_id, ADDR_GOAL_POSITION, current_pos)
+                self.bus.write1(motor_id, ADDR_TORQUE_ENABLE, 0)
                 self.motor_torque_enabled[motor_name] = False
+                self.joints[motor_name].torque_enable = 0
+                if current_pos is not None:
+                    self.joints[motor_name].goal_position = current_pos
                 
                 # Target値とスライダーを現在位置に設定
-                self.goal_labels[motor_name].config(text=f"{current_pos:4d}")
-                self.sliders[motor_name].set(current_pos)
+                if current_pos is not None:
+                    self.goal_labels[motor_name].config(text=f"{current_pos:4d}")
+                    self.sliders[motor_name].set(current_pos)
             
             self.all_torque_button.config(text="All Torque OFF")
             self.all_torque_status_label.config(text="(All Safe Mode)", foreground='green')
         else:
-            # 全モーターのトルクON
+            # 全モーターのトルクON (非常停止中ならボタン操作で解除する)
+            if self.estop.active:
+                self.estop.reset()
+                self.estop_label.config(text="")
             for motor_name in self.motor_order:
-                motor_id = self.config['follower']['calibration'][motor_name]['id']
+                motor_id = self.motor_ids[motor_name]
                 # 現在位置を取得してTarget値とスライダーに設定
-                current_pos, _, _ = self.packetHandler.read2ByteTxRx(self.portHandler, motor_id, ADDR_PRESENT_POSITION)
+                current_pos = self.bus.read2(motor_id, ADDR_PRESENT_POSITION).value
+                if current_pos is None:
+                    # 現在位置が分からないままトルクを入れると古い目標位置へ急に動くため見送る
+                    print(f"{motor_name} の現在位置を読み出せないためトルクONを見送りました")
+                    continue
                 self.goal_labels[motor_name].config(text=f"{current_pos:4d}")
                 self.sliders[motor_name].set(current_pos)
                 
-                # トルクON
-                self.packetHandler.write1ByteTxRx(self.portHandler, motor_id, ADDR_TORQUE_ENABLE, 1)
+                # トルクON (保護で下げたトルク上限も戻す)
+                self.protection.clear(motor_name)
+                self.bus.write1(motor_id, ADDR_TORQUE_ENABLE, 1)
                 self.motor_torque_enabled[motor_name] = True
+                self.joints[motor_name].torque_enable = 1
+                self.joints[motor_name].goal_position = current_pos
             
             self.all_torque_button.config(text="All Torque ON")
             self.all_torque_status_label.config(text="(All Active)", foreground='orange')
     
+    def emergency_stop(self):
+        """非常停止ボタンの処理"""
+        result = self.estop.trigger("gui")
+        for motor_name, position in result['positions'].items():
+            self.motor_torque_enabled[motor_name] = False
+            self.joints[motor_name].torque_enable = 0
+            if position is not None:
+                self.joints[motor_name].goal_position = position
+                self.goal_labels[motor_name].config(text=f"{position:4d}")
+                self.sliders[motor_name].set(position)
+        self.estop_label.config(
+            text=f"停止 {result['last_latency_ms']:.2f}ms (最大 {result['worst_latency_ms']:.2f}ms)"
+        )
+    
     def on_slider_change(self, motor_name, value):
         """スライダー変更時の処理"""
         position = int(float(value))
@@ -191,25 +254,32 @@ class SimpleRobotGUI:
         
         # トルクが有効な場合のみモーターに送信
         if self.motor_torque_enabled.get(motor_name, False):
-            motor_id = self.config['follower']['calibration'][motor_name]['id']
-            self.packetHandler.write2ByteTxRx(self.portHandler, motor_id, ADDR_GOAL_POSITION, position)
+            motor_id = self.motor_ids[motor_name]
+            self.protection.clear(motor_name)
+            self.bus.write2(motor_id, ADDR_GOAL_POSITION, position)
+            self.joints[motor_name].goal_position = position
             print(f"モーターコマンド送信: {position}")  # デバッグ用
     
-    def update_loop(self):
-        """位置更新"""
-        while self.running:
-            try:
-                # 全モーターの現在位置を表示
-                for motor_name in self.motor_order:
-                    motor_id = self.config['follower']['calibration'][motor_name]['id']
-                    position, _, _ = self.packetHandler.read2ByteTxRx(self.portHandler, motor_id, ADDR_PRESENT_POSITION)
-                    self.position_labels[motor_name].config(text=f"{position:4d}")
-                    
-                    # トルク状態も定期的に確認
-                    torque_status, _, _ = self.packetHandler.read1ByteTxRx(self.portHandler, motor_id, ADDR_TORQUE_ENABLE)
-                    self.motor_torque_enabled[motor_name] = bool(torque_status)
-                
-                # 一括トルクボタンの表示を更新
+    def on_state_change(self, changes):
+        """変化した値だけ表示を更新する"""
+        try:
+            for motor_name, values in changes.items():
+                state = self.motor_states[motor_name]
+                state.update(values)
+                if 'position' in values:
+                    self.position_labels[motor_name].config(text=f"{state['position']:4d}")
+                if any(key in values for key in ('load', 'temperature', 'voltage', 'current')):
+                    self.telemetry_labels[motor_name].config(
+                        text=f"load {state['load']:5d}  {state['temperature']:3d}℃  "
+                             f"{state['voltage']:4.1f}V  {state['current']:6.1f}mA",
+                        foreground='red' if state['temperature'] >= 60 else 'black',
+                    )
+                if 'torque_enabled' in values:
+                    self.motor_torque_enabled[motor_name] = values['torque_enabled']
+                    self.joints[motor_name].torque_enable = int(values['torque_enabled'])
+            
+            # 一括トルクボタンの表示を更新
+            if any('torque_enabled' in values for values in changes.values()):
                 all_torque_enabled = all(self.motor_torque_enabled.values())
                 if all_torque_enabled:
                     self.all_torque_button.config(text="All Torque ON")
@@ -217,10 +287,14 @@ class SimpleRobotGUI:
                 else:
                     self.all_torque_button.config(text="All Torque OFF")
                     self.all_torque_status_label.config(text="(All Safe Mode)", foreground='green')
-                
-                time.sleep(0.1)
-            except Exception:
-                break
+        except Exception:
+            self.state.stop()
+    
+    def on_sample(self, sample):
+        """テレメトリを取得するたびに保護を判定し、保護動作があれば表示する"""
+        self.protection.on_sample(sample)
+        for event in self.protection.pop_events():
+            print(f"保護動作 ({event['motor']}): {event['message']}")
     
     def check_signals(self):
         """定期的にシグナルをチェック"""
@@ -238,15 +312,13 @@ class SimpleRobotGUI:
     def stop_motors(self):
         """モーターを安全に停止"""
         try:
-            for motor_name in self.motor_order:
-                motor_id = self.config['follower']['calibration'][motor_name]['id']
-                # 現在位置を取得
-                current_pos, _, _ = self.packetHandler.read2ByteTxRx(self.portHandler, motor_id, ADDR_PRESENT_POSITION)
-                # 目標位置を現在位置に設定
-                self.packetHandler.write2ByteTxRx(self.portHandler, motor_id, ADDR_GOAL_POSITION, current_pos)
-                # トルクを無効化
-                self.packetHandler.write1ByteTxRx(self.portHandler, motor_id, ADDR_TORQUE_ENABLE, 0)
-            self.portHandler.closePort()
+            # トルク OFF のブロードキャストを最優先で送り、その後目標位置を現在位置に合わせる
+            self.state.stop()
+            result = self.estop.trigger("gui exit")
+            if not (result['sent'] or result['confirmed']):
+                print(f"トルクを切れませんでした: {self.bus.last_error}")
+            self.estop.close_socket()
+            self.bus.close()
         except Exception as e:
             print(f"モーター停止エラー: {e}")
     
@@ -262,7 +334,8 @@ class SimpleRobotGUI:
 def main():
     gui = None
     try:
-        gui = SimpleRobotGUI()
+        # 複数アームの場合は操作するアーム名を引数で指定する (例: python 05_simple_controller.py left)
+        gui = SimpleRobotGUI(*sys.argv[1:2])
         gui.run()
     except Exception as e:
         print(f"エラー: {e}")
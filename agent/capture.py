@@ -1,9 +1,15 @@
 from mcp.server.fastmcp import FastMCP
-import cv2
-from uuid import uuid4
+import sys
 import os
 
+# パッケージのルートディレクトリをパスに追加
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from camera import Camera
+
 mcp = FastMCP("WebCam")
+camera = Camera()
 
 @mcp.tool()
 def capture():
@@ -14,17 +20,12 @@ def capture():
         None
 
     Returns:
-        ファイルパス
+        ファイルパス (撮影できなかった場合はエラーメッセージ)
     """
-    cap = cv2.VideoCapture(0)
-    
-    ret, frame = cap.read()
-    cap.release()
-    
-    file_name = os.path.join("capture",f"{uuid4()}.jpg")
-    cv2.imwrite(file_name, frame)
-    
+    file_name = camera.capture()
+    if file_name is None:
+        return "カメラから画像を取得できませんでした"
     return file_name
-    
+
 if __name__ == "__main__":
-    mcp.run(transport="stdio")
\ No newline at end of file
+    mcp.run(transport="stdio")
@@ -1,29 +1,54 @@
 from mcp.server.fastmcp import FastMCP
-import yaml
 import sys
 import os
 import signal
 import atexit
+import asyncio
+import functools
+import inspect
+from concurrent.futures import ThreadPoolExecutor
 
 # パッケージのルートディレクトリをパスに追加
 if __name__ == "__main__":
     sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from servo_constants import (
-    PROTOCOL_VERSION, BAUDRATE,
     ADDR_TORQUE_ENABLE, ADDR_PRESENT_POSITION, ADDR_GOAL_POSITION,
     ADDR_POSITION_P_GAIN, ADDR_POSITION_I_GAIN, ADDR_POSITION_D_GAIN, 
-    ADDR_OPERATING_MODE,
+    ADDR_OPERATING_MODE, ONE_BYTE_REGISTERS,
 )
-from scservo_sdk import PortHandler, PacketHandler
+from config import load_arms, compile_arm, ConfigError, DEFAULT_ARM
+from bus import ServoBus, DEFAULT_RETRIES
+from state import StateService
+from protection import ProtectionMonitor
+from estop import EmergencyStop, default_socket_path
+from poses import PoseLibrary, MACROS, GRIPPER, gripper_position, interpolate
+from camera import Camera
 from time import sleep
+import time
+
+# 停止とみなすのに必要な、移動中フラグが立っていない連続サンプル数
+SETTLE_SAMPLES = 3
+# 停止を待つ最大時間 [秒]
+SETTLE_TIMEOUT_SEC = 5.0
+# 軌道のウェイポイントを送る周期 [秒]
+WAYPOINT_PERIOD_SEC = 0.02
+# 軌道の始点に使うテレメトリの現在位置の最大経過時間 [秒]。これより古ければバスから読み直す
+PRESENT_POSITION_MAX_AGE_SEC = 1.0
+# run_sequence のステップごとに必要なキー
+SEQUENCE_STEP_KEYS = {
+    "move": ("positions",),
+    "gripper": ("state",),
+    "pose": ("pose",),
+    "macro": ("macro", "pose"),
+}
 
 class Motor():
-    def __init__(self, portHandler, packetHandler, motor_id, motor_name, range_min, range_max):
-        self.portHandler = portHandler
-        self.packetHandler = packetHandler
+    def __init__(self, bus, motor_id, motor_name, range_min, range_max):
+        self.bus = bus
         self.motor_id = motor_id
         self.motor_name = motor_name
+        self.last_result = None
         self.p_gain = self.set_parameter(ADDR_POSITION_P_GAIN,16)
         self.i_gain = self.set_parameter(ADDR_POSITION_I_GAIN,0)
         self.d_gain = self.set_parameter(ADDR_POSITION_D_GAIN,32)
@@ -32,6 +57,7 @@ class Motor():
         self.torque_enable = self.set_parameter(ADDR_TORQUE_ENABLE, 1)
         self.operating_mode = self.set_parameter(ADDR_OPERATING_MODE, 0)
         self.position = self.get_paramter(ADDR_PRESENT_POSITION)
+        self.goal_position = None
     
     def validate_goal_position(self, position):
         if self.range_min <= position <= self.range_max:
@@ -42,83 +68,460 @@ class Motor():
     def set_goal_position(self, position):
         if self.validate_goal_position(position):
             self.set_parameter(ADDR_GOAL_POSITION,position)
+            if not self.last_result.ok:
+                return False
+            self.goal_position = position
             return True
         else:
             return False
     
     def get_current_position(self):
-        self.position = self.get_paramter(ADDR_PRESENT_POSITION)
-        return self.position
+        """現在位置を読み出す。通信に失敗した場合は None を返す"""
+        position = self.get_paramter(ADDR_PRESENT_POSITION)
+        if position is not None:
+            self.position = position
+        return position
     
     def set_parameter(self, address, parameter):
-        self.packetHandler.write2ByteTxRx(self.portHandler, self.motor_id, address, parameter)
+        """レジスタに書き込み、書き込んだ値を返す。通信結果は last_result に残る"""
+        write = self.bus.write1 if address in ONE_BYTE_REGISTERS else self.bus.write2
+        self.last_result = write(self.motor_id, address, parameter)
         return parameter
     
     def get_paramter(self, address):
-        return self.packetHandler.read2ByteTxRx(self.portHandler, self.motor_id, address)
+        """レジスタを読み出す。通信に失敗した場合は None を返し、通信結果は last_result に残る"""
+        read = self.bus.read1 if address in ONE_BYTE_REGISTERS else self.bus.read2
+        self.last_result = read(self.motor_id, address)
+        return self.last_result.value
     
+    def enable_torque(self):
+        self.torque_enable = self.set_parameter(ADDR_TORQUE_ENABLE, 1)
+
     def disable_torque(self):
-        self.set_parameter(ADDR_TORQUE_ENABLE, 0)
+        self.torque_enable = self.set_parameter(ADDR_TORQUE_ENABLE, 0)
 
 class So101():
-    def __init__(self, env_file=".env.yaml"):
-        with open(env_file, 'r') as f:
-            self.config = yaml.safe_load(f)
-        self.portHandler = PortHandler(self.config['follower']['port'])
-        self.packetHandler = PacketHandler(PROTOCOL_VERSION)
-        self.portHandler.openPort()
-        self.portHandler.setBaudRate(BAUDRATE)
-        self.motors = [
-            Motor(
-                self.portHandler,
-                self.packetHandler,
-                self.config['follower']['calibration'][motor_name]['id'],
-                motor_name,
-                self.config['follower']['calibration'][motor_name]["range_min"],
-                self.config['follower']['calibration'][motor_name]["range_max"],
-            ) for motor_name in sorted(self.config['follower']['calibration'].keys(),key=lambda motor_name: self.config['follower']['calibration'][motor_name]['id'])
-        ]
+    def __init__(self, env_file=".env.yaml", arm_name=DEFAULT_ARM, arm_config=None, install_handlers=True, calibration=None):
+        """
+        Args:
+            env_file (str): 設定ファイル。arm_config を渡した場合は読まない
+            arm_name (str): 駆動するアーム名
+            arm_config (dict): アームの設定 (port, calibration など)。None の場合は env_file から読む
+            install_handlers (bool): シグナルハンドラと atexit を登録するか (Fleet から作る場合は Fleet が登録する)
+            calibration (ArmCalibration): コンパイル済みのキャリブレーション。None の場合は arm_config から作る
+        """
+        if arm_config is None:
+            arm_config, calibration = load_arms(env_file)[arm_name]
+        elif calibration is None:
+            calibration = compile_arm(arm_config)
+        if calibration is None:
+            raise ConfigError(f"{arm_name} のキャリブレーションが終わっていません。04_calibrate.py を実行してください")
+        self.arm_name = arm_name
+        self.arm_config = arm_config
+        self.calibration = calibration
+        # retries / timeout_ms はアームの設定に書けば上書きできる
+        self.bus = ServoBus(
+            self.arm_config['port'],
+            retries=self.arm_config.get('retries', DEFAULT_RETRIES),
+            timeout_ms=self.arm_config.get('timeout_ms'),
+        )
+        if not self.bus.open():
+            print(f"ポート {self.bus.port} を開けませんでした。再接続を試みます", file=sys.stderr)
+        self.closed = False
         self.motors = {}
         self.set_motors()
+
+        # 動いている間は速く、静止している間は遅くテレメトリを取得する。
+        # ストールの判定は経過時間 (STALL_DURATION_SEC) で行うため、周期が下がっても遅れるのは最大 1 周期分
+        self.state = StateService(
+            self.bus,
+            self.calibration.motor_ids(),
+        )
+        self.telemetry = self.state.telemetry
+        # ストール・過熱を検出して自動で保護する
+        self.protection = ProtectionMonitor(self.motors)
+        self.telemetry.add_listener(self.protection.on_sample)
+        self.state.start()
+
+        # 非常停止 (SIGUSR1 または UNIX ソケットへの接続でも停止できる)
+        self.estop = EmergencyStop(
+            self.bus,
+            self.calibration.motor_ids(),
+        )
+        self.estop.add_listener(self._on_emergency_stop)
+        self.estop.serve_socket(self.arm_config.get('estop_socket', default_socket_path(self.bus.port)))
+
+        # 名前付き姿勢とマクロ (poses.yaml)
+        self.poses = PoseLibrary(arm_name, self.calibration)
+
+        # このアームのバス操作を直列に実行する I/O スレッド
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"so101-{arm_name}")
         
-        # クリーンアップ処理を登録
-        atexit.register(self.cleanup)
-        signal.signal(signal.SIGINT, self._signal_handler)
-        signal.signal(signal.SIGTERM, self._signal_handler)
+        if install_handlers:
+            # クリーンアップ処理を登録
+            self.estop.install_signal_handler()
+            atexit.register(self.cleanup)
+            signal.signal(signal.SIGINT, self._signal_handler)
+            signal.signal(signal.SIGTERM, self._signal_handler)
 
     def _signal_handler(self, signum, frame):
         self.cleanup()
         sys.exit(0)
 
+    def _on_emergency_stop(self, positions):
+        for motor_name, motor in self.motors.items():
+            motor.torque_enable = 0
+            if positions.get(motor_name) is not None:
+                motor.goal_position = positions[motor_name]
+
     def cleanup(self):
-        try:
-            for motor in self.motors.values():
-                motor.disable_torque()
-            self.portHandler.closePort()
-        except Exception:
-            pass
+        if getattr(self, "closed", True):
+            return
+        self.closed = True
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.estop.close_socket()
+        self.state.stop()
+        for motor in self.motors.values():
+            motor.disable_torque()
+            if not motor.last_result.ok:
+                # MCP は stdout を使うためエラーは stderr に出す
+                print(f"{motor.motor_name} のトルクを切れませんでした: {self.bus.describe(motor.last_result)}", file=sys.stderr)
+        self.bus.close()
 
     def set_motors(self):
-        for motor_name in sorted(self.config['follower']['calibration'].keys(),key=lambda motor_name: self.config['follower']['calibration'][motor_name]['id']):
-            self.motors[motor_name] = Motor(
-                self.portHandler,
-                self.packetHandler,
-                self.config['follower']['calibration'][motor_name]['id'],
-                motor_name,
-                self.config['follower']['calibration'][motor_name]["range_min"],
-                self.config['follower']['calibration'][motor_name]["range_max"],
-            )
+        calibration = self.calibration
+        for motor_name, motor_id, range_min, range_max in zip(calibration.names, calibration.ids, calibration.range_mins, calibration.range_maxs):
+            self.motors[motor_name] = Motor(self.bus, motor_id, motor_name, range_min, range_max)
+
+    def check_goals(self, positions):
+        """
+        目標位置を送れるかを確認する
+
+        Args:
+            positions (dict): モーター名をキー、目標位置を値とする辞書
+
+        Returns:
+            list: 送れない理由のメッセージのリスト (送れる場合は空)
+        """
+        if self.estop.active:
+            return ["非常停止中です。reset_emergency_stop で解除してから動かしてください"]
+        errors = []
+        for motor_name, position in positions.items():
+            if motor_name not in self.motors:
+                errors.append(f"{motor_name} というモーターはありません ({', '.join(self.motors)})")
+                continue
+            if not self.motors[motor_name].validate_goal_position(position):
+                errors.append(f"{motor_name} は {self.motors[motor_name].range_min} から {self.motors[motor_name].range_max} の値以外許されません")
+            if self.protection.is_shutdown(motor_name):
+                errors.append(f"{motor_name} は過熱のためトルクを切っています。冷えるまで待ってください")
+        return errors
+
+    def send_goals(self, positions):
+        """
+        check_goals で確認済みの目標位置を 1 回の sync-write で送る
+
+        Returns:
+            list: 送信に失敗した内容のメッセージのリスト
+        """
+        errors = []
+        for motor_name in positions:
+            self.protection.clear(motor_name)
+            motor = self.motors[motor_name]
+            if not motor.torque_enable:
+                motor.enable_torque()
+                if not motor.last_result.ok:
+                    errors.append(f"{motor_name} のトルクを入れられませんでした: {self.bus.describe(motor.last_result)}")
+        result = self.bus.sync_write2(
+            ADDR_GOAL_POSITION,
+            {self.motors[motor_name].motor_id: position for motor_name, position in positions.items()},
+        )
+        if not result.ok:
+            errors.append(f"目標位置の送信に失敗しました: {self.bus.describe(result)}")
+            return errors
+        for motor_name, position in positions.items():
+            self.motors[motor_name].goal_position = position
+        return errors
+
+    def read_positions(self, motor_names, errors):
+        """
+        現在位置を読み出す。読み出せなかったモーターは None にし、errors にメッセージを追加する
+
+        Returns:
+            dict: モーター名をキー、現在位置を値とする辞書
+        """
+        positions = {}
+        for motor_name in motor_names:
+            positions[motor_name] = self.motors[motor_name].get_current_position()
+            if positions[motor_name] is None:
+                errors.append(f"{motor_name} の現在位置の読み出しに失敗しました: {self.bus.describe(self.motors[motor_name].last_result)}")
+        return positions
+
+    def present_positions(self, motor_names):
+        """
+        最新のテレメトリから現在位置を返す。テレメトリが古い・ないモーターはバスから読み出す
+
+        Returns:
+            dict: モーター名をキー、現在位置を値とする辞書 (読み出せなかったモーターは含まない)
+        """
+        sample = self.telemetry.latest()
+        positions = {}
+        if sample is not None and time.time() - sample["timestamp"] <= PRESENT_POSITION_MAX_AGE_SEC:
+            positions = {motor_name: sample["motors"][motor_name]["position"] for motor_name in motor_names if motor_name in sample["motors"]}
+        missing = [motor_name for motor_name in motor_names if positions.get(motor_name) is None]
+        positions.update(self.read_positions(missing, []))
+        return {motor_name: position for motor_name, position in positions.items() if position is not None}
+
+    def wait_until_settled(self, motor_names, timeout=SETTLE_TIMEOUT_SEC):
+        """
+        指定したモーターが止まるまで待つ (目標位置に届かず物を掴んで止まった場合も含む)
+
+        Returns:
+            bool: timeout 秒以内に止まった場合 True
+        """
+        start = time.time()
+        deadline = time.monotonic() + timeout
+        # 目標位置を書かずに待つ場合 (run_sequence の wait) も静止の判定を遅らせない
+        self.state.boost()
+        while time.monotonic() < deadline and not self.estop.active:
+            samples = self.telemetry.history(SETTLE_SAMPLES)
+            if len(samples) == SETTLE_SAMPLES and samples[0]["timestamp"] > start and not any(
+                sample["motors"][motor_name]["moving"] for sample in samples for motor_name in motor_names
+            ):
+                return True
+            sleep(self.state.fast_period)
+        return False
+
+    def run_trajectory(self, trajectory):
+        """
+        PoseLibrary.compile でコンパイルした軌道を実行する
+
+        ウェイポイントを WAYPOINT_PERIOD_SEC ごとに sync-write で送り、各セグメントの最後で止まるまで待つ。
+        最初のセグメントは現在位置からの補間に置き換え、遠い姿勢へも一気に跳ばないようにする。
+        非常停止・範囲外・通信失敗があればその時点で中断する。
+
+        Returns:
+            dict: {"positions": 最後に動かしたモーターの現在位置, "completed": 最後まで実行したか}
+                  中断した場合は "errors" に、止まりきらなかった場合は "unsettled" にその内容を含む
+        """
+        errors = []
+        unsettled = []
+        motor_names = []
+        for index, segment in enumerate(trajectory):
+            if index == 0 and segment:
+                segment = interpolate(self.present_positions(list(segment[-1])), segment[-1])
+            for waypoint in segment:
+                errors = self.check_goals(waypoint) or self.send_goals(waypoint)
+                if errors:
+                    break
+                motor_names = list(waypoint)
+                if len(segment) > 1:
+                    sleep(WAYPOINT_PERIOD_SEC)
+            if errors:
+                break
+            if not self.wait_until_settled(motor_names):
+                unsettled.append(index)
+
+        result = {"completed": not errors}
+        result["positions"] = self.read_positions(motor_names, errors)
+        if errors:
+            result["errors"] = errors
+        if unsettled:
+            result["unsettled"] = unsettled
+        return result
+
+    def compile_sequence(self, steps):
+        """
+        run_sequence のステップを確認して実行できる形にする。1 つでも不正なステップがあれば何も実行しない
+
+        Returns:
+            tuple: (実行用のステップのリスト, エラーメッセージのリスト)
+        """
+        compiled = []
+        errors = []
+        for index, step in enumerate(steps):
+            action = step.get("action") if isinstance(step, dict) else None
+            try:
+                missing = [key for key in SEQUENCE_STEP_KEYS.get(action, ()) if key not in step]
+                if missing:
+                    raise ValueError(f"{action} には {', '.join(missing)} を指定してください")
+                if action == "move":
+                    positions = dict(step["positions"])
+                    step_errors = self.check_goals(positions)
+                    if step_errors:
+                        raise ValueError(", ".join(step_errors))
+                    compiled.append(("move", positions))
+                elif action == "gripper":
+                    if step.get("state") not in ("open", "close"):
+                        raise ValueError("state は open か close です")
+                    compiled.append(("move", {GRIPPER: gripper_position(self.calibration, step["state"])}))
+                elif action == "pose":
+                    compiled.append(("trajectory", self.poses.compile(None, step["pose"])))
+                elif action == "macro":
+                    compiled.append(("trajectory", self.poses.compile(step["macro"], step["pose"])))
+                elif action == "wait":
+                    compiled.append(("wait", float(step.get("timeout", SETTLE_TIMEOUT_SEC))))
+                elif action == "capture":
+                    compiled.append(("capture", None))
+                else:
+                    raise ValueError(f"action {action} はありません (move, gripper, pose, macro, wait, capture)")
+            except KeyError as e:
+                errors.append(f"ステップ {index}: {e.args[0]}")
+            except (TypeError, ValueError) as e:
+                errors.append(f"ステップ {index}: {e}")
+        return compiled, errors
+
+    def run_sequence(self, steps, camera):
+        """
+        compile_sequence で確認したステップを順に実行する。非常停止・通信失敗・撮影失敗で中断する
+
+        Returns:
+            dict: 実行結果 (run_sequence ツールの Returns を参照)
+        """
+        errors = []
+        unsettled = []
+        captures = []
+        moved = set()
+        executed = 0
+        for index, (action, argument) in enumerate(steps):
+            if self.estop.active:
+                errors.append("非常停止中です。reset_emergency_stop で解除してから動かしてください")
+                break
+            if action == "move":
+                errors = self.check_goals(argument) or self.send_goals(argument)
+                moved.update(argument)
+            elif action == "trajectory":
+                result = self.run_trajectory(argument)
+                errors = result.get("errors", []) if not result["completed"] else []
+                if "unsettled" in result:
+                    unsettled.append(index)
+                moved.clear()
+            elif action == "wait":
+                if not self.wait_until_settled(moved or self.motors.keys(), argument):
+                    unsettled.append(index)
+                moved.clear()
+            elif action == "capture":
+                image = camera.capture()
+                if image is None:
+                    errors = ["カメラから画像を取得できませんでした"]
+                else:
+                    latest = self.telemetry.latest()
+                    captures.append({
+                        "step": index,
+                        "image": image,
+                        "positions": {motor_name: sample["position"] for motor_name, sample in latest["motors"].items()} if latest else None,
+                    })
+            if errors:
+                errors = [f"ステップ {index}: {error}" for error in errors]
+                break
+            executed += 1
+
+        result = {"completed": executed == len(steps), "executed": executed, "captures": captures}
+        result["positions"] = self.read_positions(self.motors.keys(), errors)
+        if errors:
+            result["errors"] = errors
+        if unsettled:
+            result["unsettled"] = unsettled
+        return result
+
+    def snapshot(self):
+        """このアームの状態 (最新テレメトリ・バス・非常停止) を返す"""
+        return {
+            "telemetry": self.telemetry.latest(),
+            "bus": self.bus.health(),
+            "estop": self.estop.stats(),
+        }
 
     def __del__(self):
         self.cleanup()
 
 
-so101 = So101()
+class Fleet():
+    """
+    1 プロセスで複数のアームを駆動する
 
-mcp = FastMCP("SO101")
+    アームごとに専用の I/O スレッド (So101.executor) を持ち、run() で非同期に処理を振り分ける。
+    同じアームへの操作は直列に、別のアームへの操作は並行に実行される。
+    """
 
-@mcp.tool()
-def set_motors_position(motor_position_dict):
+    def __init__(self, env_file=".env.yaml"):
+        arms = load_arms(env_file)
+        # 1 台でもキャリブレーションが終わっていなければ、どのポートも開かずに止める
+        for arm_name, (arm_config, calibration) in arms.items():
+            if calibration is None:
+                raise ConfigError(f"{arm_name} のキャリブレーションが終わっていません。04_calibrate.py を実行してください")
+
+        # ポートを開いてモーターを初期化する処理はアームごとに並行して行う
+        with ThreadPoolExecutor(max_workers=len(arms)) as executor:
+            futures = {
+                arm_name: executor.submit(So101, env_file, arm_name, arm_config, False, calibration)
+                for arm_name, (arm_config, calibration) in arms.items()
+            }
+        built = {arm_name: future.result() for arm_name, future in futures.items() if future.exception() is None}
+        if len(built) < len(futures):
+            # 初期化に失敗したアームがあれば、開いたポートを閉じてから例外を伝える
+            for arm in built.values():
+                arm.cleanup()
+            for future in futures.values():
+                future.result()
+        self.arms = built
+
+        # クリーンアップ処理を登録
+        atexit.register(self.cleanup)
+        signal.signal(signal.SIGINT, self._signal_handler)
+        signal.signal(signal.SIGTERM, self._signal_handler)
+        signal.signal(signal.SIGUSR1, self._estop_signal_handler)
+
+    async def run(self, arm_name, function, *args, **kwargs):
+        """function(so101, *args, **kwargs) をアームの I/O スレッドで実行する"""
+        arm = self.arms[arm_name]
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(arm.executor, functools.partial(function, arm, *args, **kwargs))
+
+    def snapshot(self):
+        """全アームの状態を返す"""
+        return {arm_name: arm.snapshot() for arm_name, arm in self.arms.items()}
+
+    def emergency_stop(self, reason="fleet"):
+        """全アームを非常停止する。トルク OFF の送信を全バスで先に済ませてから後処理を行う"""
+        for arm in self.arms.values():
+            arm.bus.send_torque_off()
+        with ThreadPoolExecutor(max_workers=len(self.arms)) as executor:
+            futures = {arm_name: executor.submit(arm.estop.trigger, reason) for arm_name, arm in self.arms.items()}
+            return {arm_name: future.result() for arm_name, future in futures.items()}
+
+    def _estop_signal_handler(self, signum, frame):
+        for arm in self.arms.values():
+            arm.estop._signal_handler(signum, frame)
+
+    def _signal_handler(self, signum, frame):
+        self.cleanup()
+        sys.exit(0)
+
+    def cleanup(self):
+        for arm in self.arms.values():
+            arm.cleanup()
+
+
+def arm_tool(fleet, arm_name, function, immediate=False):
+    """
+    function(so101, ...) を、指定したアームの I/O スレッドで実行する非同期ツール関数にする
+
+    immediate=True の場合は I/O スレッドの順番を待たずにその場で実行する (非常停止用)。
+    """
+    if immediate:
+        def tool(*args, **kwargs):
+            return function(fleet.arms[arm_name], *args, **kwargs)
+    else:
+        async def tool(*args, **kwargs):
+            return await fleet.run(arm_name, function, *args, **kwargs)
+    signature = inspect.signature(function)
+    tool.__signature__ = signature.replace(parameters=list(signature.parameters.values())[1:])
+    tool.__name__ = function.__name__
+    tool.__doc__ = function.__doc__
+    return tool
+
+
+def set_motors_position(so101, motor_position_dict):
     """
     ロボットアームのすべてのモーターを同時に指定位置に移動させる
     
@@ -138,31 +541,27 @@ def set_motors_position(motor_position_dict):
     
     Returns:
         dict or list: 成功時は各モーターの現在位置を含む辞書、
-                     失敗時は範囲外エラーメッセージのリスト
+                     移動中にストール・過熱を検出した場合は "protection_events" キーにその内容を含む。
+                     通信に失敗したモーターの現在位置は None になり、"bus_errors" キーにその内容を含む。
+                     失敗時は非常停止中・範囲外エラーメッセージ、または過熱で停止中のモーターのエラーメッセージのリスト
     """
-    errors = []
-    enable = True
-    for motor in motor_position_dict.keys():
-        enable *= so101.motors[motor].validate_goal_position(motor_position_dict[motor])
-        if enable:
-            pass
-        else:
-            errors.append(f"{motor} は {so101.motors[motor].range_min} から {so101.motors[motor].range_max} の値以外許されません")
+    errors = so101.check_goals(motor_position_dict)
     
-    if enable:
-        for motor in motor_position_dict.keys():
-            so101.motors[motor].set_goal_position(motor_position_dict[motor])
+    if not errors:
+        bus_errors = so101.send_goals(motor_position_dict)
         sleep(1)
-        result = {}
-        for motor in motor_position_dict.keys():
-            result[motor] = so101.motors[motor].get_current_position()
+        result = so101.read_positions(motor_position_dict.keys(), bus_errors)
+        if bus_errors:
+            result["bus_errors"] = bus_errors
+        events = so101.protection.pop_events()
+        if events:
+            result["protection_events"] = events
         return result
 
     else:
         return errors
 
-@mcp.tool()
-def get_motors_position():
+def get_motors_position(so101):
     """
     ロボットアームのすべてのモーターの現在位置を取得する
 
@@ -170,7 +569,7 @@ def get_motors_position():
         None
 
     Returns:
-        dict: モーター名をキー、現在位置を値とする辞書
+        dict: モーター名をキー、現在位置を値とする辞書 (通信に失敗したモーターは None)
               例: {
                   "shoulder_pan": 2048,
                   "shoulder_lift": 2048,
@@ -184,6 +583,335 @@ def get_motors_position():
     for motor in so101.motors.keys():
         result[motor] = so101.motors[motor].get_current_position()
     return result
+
+def get_telemetry(so101, samples=1):
+    """
+    ロボットアームのすべてのモーターのテレメトリ (位置・速度・負荷・電圧・温度・電流・移動中フラグ) を取得する
+
+    Args:
+        samples (int): 取得するサンプル数。新しいものから最大 samples 件を古い順に返す。
+                       取得周期は動いている間 50 Hz、静止が続くと 2 Hz まで下がる (timestamp で間隔を確認できる)。
+
+    Returns:
+        list: サンプルのリスト。各サンプルは以下の形式
+              {
+                  "timestamp": 1700000000.0,
+                  "motors": {
+                      "gripper": {
+                          "position": 2048,
+                          "velocity": 0,
+                          "load": 120,          # 負荷 [0.1%] 符号付き
+                          "voltage": 12.1,      # 電圧 [V]
+                          "temperature": 35,    # 温度 [℃]
+                          "current": 65.0,      # 電流 [mA]
+                          "moving": false
+                      },
+                      ...
+                  }
+              }
+    """
+    return so101.telemetry.history(int(samples))
+
+def get_protection_events(so101):
+    """
+    ストール・過負荷・過熱の検出により自動で行った保護動作のイベントを取得する (取得したイベントは消去される)
+
+    Args:
+        None
+
+    Returns:
+        list: イベントのリスト。各イベントは以下の形式
+              {
+                  "timestamp": 1700000000.0,
+                  "motor": "gripper",
+                  "event": "stall",          # stall / overload / overheat_trend / overheat
+                  "action": "goal_backoff",  # goal_backoff / torque_limit / torque_off
+                  "position": 1800,
+                  "load": 650,
+                  "temperature": 48,
+                  "message": "..."
+              }
+    """
+    return so101.protection.pop_events()
+
+def get_bus_health(so101):
+    """
+    サーボバスの健全性と通信統計を取得する
+
+    Args:
+        None
+
+    Returns:
+        dict: 以下の形式
+              {
+                  "port": "/dev/tty.usbmodem0000",
+                  "state": "ok",               # ok / degraded (直近の通信が失敗) / disconnected (ポート切断中)
+                  "transactions": 1000,
+                  "failures": 2,
+                  "retries": 3,
+                  "reconnects": 0,
+                  "consecutive_failures": 0,
+                  "last_error": "...",
+                  "last_error_time": 1700000000.0,
+                  "exceptions": 0              # テレメトリ処理 (保護の判定など) で起きた例外の数。0 以外なら保護が働いていない可能性がある
+              }
+    """
+    return so101.bus.health()
+
+def emergency_stop(so101):
+    """
+    非常停止: すべてのモーターのトルクを最優先で切る。危険を感じたら他の操作より先に呼ぶこと。
+    解除するまで set_motors_position は受け付けない。
+
+    Args:
+        None
+
+    Returns:
+        dict: 以下の形式
+              {
+                  "active": true,
+                  "count": 1,
+                  "last_reason": "mcp",
+                  "last_time": 1700000000.0,
+                  "last_latency_ms": 0.1,           # トルク OFF パケット送信までの遅延
+                  "worst_latency_ms": 0.2,
+                  "last_confirm_latency_ms": 2.0,   # バスが空いてからの再送までの遅延
+                  "worst_confirm_latency_ms": 35.0,
+                  "sent": true,
+                  "confirmed": true,
+                  "positions": {"gripper": 2048, ...}
+              }
+    """
+    return so101.estop.trigger("mcp")
+
+def reset_emergency_stop(so101):
+    """
+    非常停止を解除する。トルクは次の set_motors_position で動かすモーターから入る。
+
+    Args:
+        None
+
+    Returns:
+        dict: 非常停止の状態と遅延の統計 (emergency_stop と同じ形式。sent / confirmed / positions は含まない)
+    """
+    so101.estop.reset()
+    return so101.estop.stats()
+
+def save_pose(so101, name):
+    """
+    現在の姿勢 (すべてのモーターの現在位置) を名前を付けて保存する。同じ名前があれば上書きする。
+
+    Args:
+        name (str): 姿勢の名前 (例: "左上")
+
+    Returns:
+        dict or list: 成功時は保存した姿勢 (モーター名をキー、位置を値とする辞書)、失敗時はエラーメッセージのリスト
+    """
+    errors = []
+    positions = so101.read_positions(so101.motors.keys(), errors)
+    if errors:
+        return errors
+    try:
+        so101.poses.save(name, positions)
+    except ValueError as e:
+        return [str(e)]
+    return positions
+
+def delete_pose(so101, name):
+    """
+    保存済みの姿勢を削除する
+
+    Args:
+        name (str): 姿勢の名前 (list_poses で確認できる)
+
+    Returns:
+        list: 残っている姿勢の名前のリスト。失敗時はエラーメッセージのリスト
+    """
+    try:
+        so101.poses.delete(name)
+    except KeyError as e:
+        return [e.args[0]]
+    return so101.poses.names()
+
+def list_poses(so101):
+    """
+    保存済みの姿勢の名前と、run_macro で使えるマクロの名前を取得する
+
+    Args:
+        None
+
+    Returns:
+        dict: {"poses": ["左上", "右上", ...], "macros": ["approach", "grasp", "lift", "pick", "place"]}
+    """
+    return {"poses": so101.poses.names(), "macros": list(MACROS)}
+
+def move_to_pose(so101, name):
+    """
+    保存済みの姿勢へ移動し、止まるまで待つ
+
+    Args:
+        name (str): 姿勢の名前 (list_poses で確認できる)
+
+    Returns:
+        dict or list: run_macro と同じ形式。姿勢がない場合はエラーメッセージのリスト
+    """
+    return run_macro(so101, None, name)
+
+def run_macro(so101, macro, pose):
+    """
+    姿勢を対象にしたマクロをサーバー側で一括実行する。途中の姿勢は補間され、各段階で止まるまで待つ。
+        approach: 姿勢の真上でグリッパーを開き、姿勢まで降ろす
+        grasp: その場でグリッパーを閉じる
+        lift: 姿勢の真上まで持ち上げる (グリッパーはそのまま)
+        pick: approach → grasp → lift
+        place: 姿勢の真上から降ろしてグリッパーを開き、真上に戻る
+
+    Args:
+        macro (str): マクロの名前 (list_poses で確認できる)
+        pose (str): 対象の姿勢の名前
+
+    Returns:
+        dict or list: 以下の形式。マクロや姿勢がない場合・可動範囲外の場合はエラーメッセージのリスト
+              {
+                  "completed": true,                  # 非常停止・エラーで中断した場合は false
+                  "positions": {"gripper": 1500, ...},  # 最後に動かしたモーターの現在位置
+                  "errors": [...],                    # 中断した理由 (ある場合のみ)
+                  "unsettled": [1],                   # 時間内に止まらなかった段階の番号 (ある場合のみ)
+                  "protection_events": [...]          # 実行中の保護動作 (ある場合のみ)
+              }
+    """
+    try:
+        trajectory = so101.poses.compile(macro, pose)
+    except (KeyError, ValueError) as e:
+        return [e.args[0]]
+    result = so101.run_trajectory(trajectory)
+    events = so101.protection.pop_events()
+    if events:
+        result["protection_events"] = events
+    return result
+
+def run_sequence(so101, steps):
+    """
+    移動・停止待ち・グリッパー開閉・撮影のステップを順にサーバー側で一括実行し、結果をまとめて返す。
+    1 回の呼び出しで「動かして撮影」を何度も行えるので、動かすたびに capture を呼ぶ必要はない。
+    不正なステップが 1 つでもあれば何も実行せずにエラーを返す。非常停止・通信失敗・撮影失敗があればそこで中断する。
+
+    Args:
+        steps (list): ステップのリスト。各ステップは以下のいずれか
+            {"action": "move", "positions": {"shoulder_pan": 2048, ...}}  # 目標位置を送る (止まるのは待たない)
+            {"action": "gripper", "state": "open"}                       # グリッパーを開く ("close" で閉じる)
+            {"action": "pose", "pose": "左上"}                            # 保存済みの姿勢へ移動し、止まるまで待つ
+            {"action": "macro", "macro": "pick", "pose": "左上"}          # run_macro と同じマクロを実行する
+            {"action": "wait", "timeout": 5}                             # 直前に動かしたモーターが止まるまで待つ (timeout は省略可)
+            {"action": "capture"}                                        # Web カメラで撮影する
+        例: 左上の姿勢へ移動して撮影し、グリッパーを閉じて撮影する
+            [
+                {"action": "pose", "pose": "左上"},
+                {"action": "capture"},
+                {"action": "gripper", "state": "close"},
+                {"action": "wait"},
+                {"action": "capture"}
+            ]
+
+    Returns:
+        dict or list: 以下の形式。不正なステップがある場合はエラーメッセージのリスト
+              {
+                  "completed": true,            # すべてのステップを実行したか
+                  "executed": 5,                # 実行したステップ数
+                  "captures": [                 # 撮影した画像と撮影時の各モーターの位置
+                      {"step": 1, "image": "capture/xxxx.jpg", "positions": {"gripper": 3000, ...}},
+                      ...
+                  ],
+                  "positions": {"gripper": 1600, ...},  # 実行後のすべてのモーターの現在位置
+                  "errors": [...],              # 中断した理由 (ある場合のみ)
+                  "unsettled": [3],             # 時間内に止まらなかったステップの番号 (ある場合のみ)
+                  "protection_events": [...]    # 実行中の保護動作 (ある場合のみ)
+              }
+    """
+    compiled, errors = so101.compile_sequence(steps)
+    if errors:
+        return errors
+    # 撮影するステップがあれば、実行中はカメラを開いたままにする
+    uses_camera = any(action == "capture" for action, _ in compiled)
+    try:
+        if uses_camera:
+            camera.open()
+        result = so101.run_sequence(compiled, camera)
+    finally:
+        if uses_camera:
+            camera.close()
+    events = so101.protection.pop_events()
+    if events:
+        result["protection_events"] = events
+    return result
+
+
+# アームごとのツールと、I/O スレッドの順番を待たずに実行するか
+ARM_TOOLS = [
+    (set_motors_position, False),
+    (get_motors_position, False),
+    (get_telemetry, False),
+    (get_protection_events, False),
+    (get_bus_health, False),
+    (emergency_stop, True),
+    (reset_emergency_stop, True),
+    (save_pose, False),
+    (delete_pose, False),
+    (list_poses, False),
+    (move_to_pose, False),
+    (run_macro, False),
+    (run_sequence, False),
+]
+
+fleet = Fleet()
+camera = Camera()
+
+mcp = FastMCP("SO101")
+
+# .env.yaml に arms で複数アームを定義した場合は、ツール名の先頭にアーム名を付けて
+# アームごとの名前空間にする (例: left_set_motors_position)
+namespaced = list(fleet.arms) != [DEFAULT_ARM]
+for arm_name in fleet.arms:
+    for function, immediate in ARM_TOOLS:
+        if namespaced:
+            mcp.add_tool(
+                arm_tool(fleet, arm_name, function, immediate),
+                name=f"{arm_name}_{function.__name__}",
+                description=f"[アーム {arm_name}] {inspect.cleandoc(function.__doc__)}",
+            )
+        else:
+            mcp.add_tool(arm_tool(fleet, arm_name, function, immediate))
+
+@mcp.tool()
+def get_fleet_state():
+    """
+    すべてのアームの状態を一度に取得する
+
+    Args:
+        None
+
+    Returns:
+        dict: アーム名をキーとし、以下の形式の値を持つ辞書
+              {
+                  "telemetry": {...},   # get_telemetry の最新サンプル (未取得の場合は null)
+                  "bus": {...},         # get_bus_health と同じ形式
+                  "estop": {...}        # reset_emergency_stop と同じ形式
+              }
+    """
+    return fleet.snapshot()
+
+@mcp.tool()
+def emergency_stop_all():
+    """
+    すべてのアームを非常停止する。全アームにトルク OFF を送ってから後処理を行う。
+
+    Args:
+        None
+
+    Returns:
+        dict: アーム名をキー、emergency_stop の結果を値とする辞書
+    """
+    return fleet.emergency_stop("mcp")
     
 if __name__ == "__main__":
     mcp.run(transport="stdio")
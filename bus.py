@@ -0,0 +1,349 @@
+import os
+import threading
+import time
+from collections import namedtuple
+
+import serial
+from scservo_sdk import (
+    PortHandler, PacketHandler, GroupSyncRead, GroupSyncWrite,
+    COMM_SUCCESS, COMM_NOT_AVAILABLE, BROADCAST_ID, INST_WRITE,
+    SCS_LOBYTE, SCS_HIBYTE,
+)
+from servo_constants import PROTOCOL_VERSION, BAUDRATE, ADDR_TORQUE_ENABLE
+
+# 1 トランザクションあたりの再試行回数
+DEFAULT_RETRIES = 2
+# ポートの再オープンを試みる最小間隔 [秒]
+RECONNECT_INTERVAL_SEC = 1.0
+
+# バスの健全性
+HEALTH_OK = "ok"
+HEALTH_DEGRADED = "degraded"
+HEALTH_DISCONNECTED = "disconnected"
+
+# ポートが開けない・切断中などで送信自体を行わなかった場合の通信結果
+COMM_PORT_CLOSED = -100
+# 非常停止中のためトルク ON を拒否した場合の通信結果
+COMM_HALTED = -101
+
+
+def broadcast_write1_packet(address, value):
+    """全モーターへ 1 バイト書き込むブロードキャストパケットを組み立てる"""
+    body = [BROADCAST_ID, 4, INST_WRITE, address, value]
+    return bytes([0xFF, 0xFF] + body + [~sum(body) & 0xFF])
+
+
+# 全モーターのトルクを切るパケット (応答は返らない)
+TORQUE_OFF_PACKET = broadcast_write1_packet(ADDR_TORQUE_ENABLE, 0)
+
+
+class BusResult(namedtuple("BusResult", ["value", "comm_result", "error"])):
+    """
+    バストランザクションの結果
+
+    Attributes:
+        value: 読み出した値 (書き込みの場合は書き込んだ値、失敗時は None)
+        comm_result (int): scservo_sdk の COMM_* 通信結果コード
+        error (int): サーボから返されたエラービット (過熱・過負荷など)
+    """
+
+    @property
+    def ok(self):
+        return self.comm_result == COMM_SUCCESS
+
+
+class _TimeoutPortHandler(PortHandler):
+    """応答待ちタイムアウトを指定できる PortHandler"""
+
+    def __init__(self, port_name, timeout_ms=None):
+        super().__init__(port_name)
+        self.timeout_ms = timeout_ms
+
+    def setPacketTimeout(self, packet_length):
+        if self.timeout_ms is None:
+            return super().setPacketTimeout(packet_length)
+        self.packet_start_time = self.getCurrentTime()
+        self.packet_timeout = (self.tx_time_per_byte * packet_length) + self.timeout_ms
+
+
+class ServoBus():
+    """
+    1 本のシリアルポート上のサーボバス
+
+    すべてのトランザクションをロックで直列化し、失敗時は回数を限って再試行する。
+    USB が抜けた場合 (シリアルポートの例外・デバイスファイルの消失) だけポートを開き直し、健全性を health() で公開する。
+    サーボが応答しないだけの失敗 (応答タイムアウトなど) では開き直さず degraded として報告する。
+    """
+
+    def __init__(self, port, baudrate=BAUDRATE, retries=DEFAULT_RETRIES, timeout_ms=None):
+        """
+        Args:
+            port (str): シリアルポートのパス
+            baudrate (int): ボーレート
+            retries (int): 1 トランザクションあたりの再試行回数
+            timeout_ms (float): 応答待ちタイムアウト [ms]。None の場合は SDK の既定値
+        """
+        self.port = port
+        self.baudrate = baudrate
+        self.retries = retries
+        self.portHandler = _TimeoutPortHandler(port, timeout_ms)
+        self.packetHandler = PacketHandler(PROTOCOL_VERSION)
+        self.lock = threading.RLock()
+        self.is_open = False
+        # close() で明示的に閉じた場合は自動再接続しない
+        self.closed = False
+        # 非常停止中は clear_halt() が呼ばれるまでトルク ON の書き込みを拒否する
+        self.halted = False
+        self.last_reconnect_attempt = 0.0
+        self.transactions = 0
+        self.failures = 0
+        self.retried = 0
+        self.reconnects = 0
+        self.consecutive_failures = 0
+        self.last_error = None
+        self.last_error_time = None
+        # バスの利用者 (テレメトリのリスナーなど) で起きた例外の数
+        self.exceptions = 0
+        self.write_listeners = []
+
+    def set_timeout(self, timeout_ms):
+        """応答待ちタイムアウト [ms] を変更する。None で SDK の既定値に戻す"""
+        self.portHandler.timeout_ms = timeout_ms
+
+    def open(self):
+        with self.lock:
+            self.closed = False
+            try:
+                self.is_open = bool(self.portHandler.openPort()) and bool(self.portHandler.setBaudRate(self.baudrate))
+            except (serial.SerialException, OSError) as e:
+                self.is_open = False
+                self._record_error(f"ポート {self.port} を開けませんでした: {e}")
+            self.portHandler.is_using = False
+            return self.is_open
+
+    def close(self):
+        with self.lock:
+            try:
+                if self.portHandler.ser is not None:
+                    self.portHandler.closePort()
+            except (serial.SerialException, OSError) as e:
+                self._record_error(f"ポート {self.port} を閉じられませんでした: {e}")
+            self.is_open = False
+            self.closed = True
+
+    def reconnect(self):
+        """ポートを開き直す (RECONNECT_INTERVAL_SEC 以内の連続試行は行わない)"""
+        with self.lock:
+            now = time.monotonic()
+            if now - self.last_reconnect_attempt < RECONNECT_INTERVAL_SEC:
+                return self.is_open
+            self.last_reconnect_attempt = now
+            self.close()
+            self.reconnects += 1
+            return self.open()
+
+    def read1(self, motor_id, address):
+        return self._transact(self._read, self.packetHandler.read1ByteTxRx, motor_id, address)
+
+    def read2(self, motor_id, address):
+        return self._transact(self._read, self.packetHandler.read2ByteTxRx, motor_id, address)
+
+    def write1(self, motor_id, address, value):
+        if self._is_blocked(address, value):
+            return BusResult(None, COMM_HALTED, 0)
+        result = self._transact(self._write, self.packetHandler.write1ByteTxRx, motor_id, address, value)
+        self._notify_write(motor_id, address)
+        return result
+
+    def write2(self, motor_id, address, value):
+        if self._is_blocked(address, value):
+            return BusResult(None, COMM_HALTED, 0)
+        result = self._transact(self._write, self.packetHandler.write2ByteTxRx, motor_id, address, value)
+        self._notify_write(motor_id, address)
+        return result
+
+    def add_write_listener(self, listener):
+        """
+        書き込みのたびに呼ばれるコールバックを登録する (レジスタの値をキャッシュしている側が無効化に使う)
+
+        コールバックは (モーター ID, レジスタアドレス) を引数に、書き込みの成否にかかわらず呼ばれる。
+        ブロードキャストの場合のモーター ID は BROADCAST_ID。
+        """
+        self.write_listeners.append(listener)
+
+    def _notify_write(self, motor_id, address):
+        for listener in self.write_listeners:
+            listener(motor_id, address)
+
+    def _is_blocked(self, address, value):
+        return self.halted and address == ADDR_TORQUE_ENABLE and value != 0
+
+    def send_torque_off(self, wait_idle=False):
+        """
+        全モーターへトルク OFF のブロードキャストを送り、以後トルク ON を拒否する
+
+        Args:
+            wait_idle (bool): False の場合は実行中のトランザクションを待たずに送信する。
+                              True の場合はロックを取得してバスが空いてから送信する。
+
+        Returns:
+            bool: 送信できた場合 True
+        """
+        self.halted = True
+        if wait_idle:
+            with self.lock:
+                sent = self._write_raw(TORQUE_OFF_PACKET)
+        else:
+            sent = self._write_raw(TORQUE_OFF_PACKET)
+        self._notify_write(BROADCAST_ID, ADDR_TORQUE_ENABLE)
+        return sent
+
+    def clear_halt(self):
+        """非常停止を解除してトルク ON を許可する"""
+        self.halted = False
+
+    def _write_raw(self, packet):
+        try:
+            self.portHandler.writePort(packet)
+            self.portHandler.ser.flush()
+            return True
+        except (serial.SerialException, OSError, AttributeError) as e:
+            self._record_error(f"ポート {self.port} へのトルク OFF 送信に失敗しました: {e}")
+            return False
+
+    def make_sync_read(self, start_address, data_length, motor_ids):
+        """このバス上の GroupSyncRead を作成する"""
+        group = GroupSyncRead(self.portHandler, self.packetHandler, start_address, data_length)
+        for motor_id in motor_ids:
+            group.addParam(motor_id)
+        return group
+
+    def sync_read(self, group):
+        """GroupSyncRead を実行する。読み出した値は group.getData で取り出す"""
+        return self._transact(self._sync_read, group)
+
+    def sync_write2(self, address, values):
+        """
+        複数モーターの 2 バイトのレジスタに 1 パケットで書き込む (ブロードキャストのため応答は返らない)
+
+        Args:
+            address (int): レジスタアドレス
+            values (dict): モーター ID をキー、書き込む値を値とする辞書
+        """
+        if any(self._is_blocked(address, value) for value in values.values()):
+            return BusResult(None, COMM_HALTED, 0)
+        group = GroupSyncWrite(self.portHandler, self.packetHandler, address, 2)
+        for motor_id, value in values.items():
+            group.addParam(motor_id, [SCS_LOBYTE(value), SCS_HIBYTE(value)])
+        result = self._transact(self._sync_write, group, values)
+        for motor_id in values:
+            self._notify_write(motor_id, address)
+        return result
+
+    def _sync_write(self, group, values):
+        comm_result = group.txPacket()
+        return BusResult(values if comm_result == COMM_SUCCESS else None, comm_result, 0)
+
+    def _read(self, function, motor_id, address):
+        value, comm_result, error = function(self.portHandler, motor_id, address)
+        return BusResult(value if comm_result == COMM_SUCCESS else None, comm_result, error)
+
+    def _write(self, function, motor_id, address, value):
+        comm_result, error = function(self.portHandler, motor_id, address, value)
+        return BusResult(value if comm_result == COMM_SUCCESS else None, comm_result, error)
+
+    def _sync_read(self, group):
+        comm_result = group.txRxPacket()
+        return BusResult(None, comm_result, 0)
+
+    def _transact(self, function, *args):
+        with self.lock:
+            result = BusResult(None, COMM_PORT_CLOSED, 0)
+            for attempt in range(self.retries + 1):
+                if attempt > 0:
+                    self.retried += 1
+                if not self.is_open and (self.closed or not self.reconnect()):
+                    result = BusResult(None, COMM_PORT_CLOSED, 0)
+                    continue
+                try:
+                    result = function(*args)
+                except (serial.SerialException, OSError) as e:
+                    # USB 切断など。次の試行でポートを開き直す
+                    self.is_open = False
+                    self.portHandler.is_using = False
+                    self._record_error(f"ポート {self.port} で通信エラー: {e}")
+                    result = BusResult(None, COMM_PORT_CLOSED, 0)
+                    continue
+                if result.ok:
+                    break
+                # 途中で失敗したパケットの送受信フラグや受信途中のデータが残らないようにする
+                self.portHandler.is_using = False
+                self._discard_input()
+
+            self.transactions += 1
+            if result.ok:
+                self.consecutive_failures = 0
+            else:
+                self.failures += 1
+                self.consecutive_failures += 1
+                self._record_error(self.describe(result))
+                if self.is_open and not self._port_present():
+                    # デバイスファイルが消えた (USB が抜けた) 場合は次のトランザクションで開き直す
+                    self.is_open = False
+            return result
+
+    def _port_present(self):
+        # /dev/ 以下などのパスで指定されたポートはデバイスファイルの有無で接続を確認する (COM3 などは確認できない)
+        return not os.path.isabs(self.port) or os.path.exists(self.port)
+
+    def _discard_input(self):
+        try:
+            self.portHandler.ser.reset_input_buffer()
+        except (serial.SerialException, OSError, AttributeError):
+            pass
+
+    def describe(self, result):
+        """BusResult を人が読めるメッセージにする"""
+        if result.comm_result == COMM_PORT_CLOSED:
+            return f"ポート {self.port} が開いていません"
+        if result.comm_result == COMM_HALTED:
+            return "非常停止中のためトルク ON できません"
+        if result.comm_result == COMM_NOT_AVAILABLE:
+            return "読み出し対象のモーターがありません"
+        if not result.ok:
+            return self.packetHandler.getTxRxResult(result.comm_result)
+        if result.error:
+            return self.packetHandler.getRxPacketError(result.error)
+        return "成功"
+
+    def record_exception(self, message):
+        """バスの利用者 (テレメトリのリスナーなど) で起きた例外を記録し、health() に反映する"""
+        self.exceptions += 1
+        self._record_error(message)
+
+    def _record_error(self, message):
+        self.last_error = message
+        self.last_error_time = time.time()
+
+    def state(self):
+        if not self.is_open:
+            return HEALTH_DISCONNECTED
+        if self.consecutive_failures > 0:
+            return HEALTH_DEGRADED
+        return HEALTH_OK
+
+    def health(self):
+        """バスの健全性と通信統計を返す"""
+        return {
+            "port": self.port,
+            "state": self.state(),
+            "halted": self.halted,
+            "transactions": self.transactions,
+            "failures": self.failures,
+            "retries": self.retried,
+            "reconnects": self.reconnects,
+            "consecutive_failures": self.consecutive_failures,
+            "last_error": self.last_error,
+            "last_error_time": self.last_error_time,
+            "exceptions": self.exceptions,
+        }
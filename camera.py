@@ -0,0 +1,70 @@
+import os
+import threading
+from uuid import uuid4
+
+import cv2
+
+# 撮影した画像の保存先
+DEFAULT_CAPTURE_DIR = "capture"
+
+
+class Camera():
+    """
+    Web カメラで撮影して画像をファイルに保存する
+
+    open() している間はデバイスを開いたままにして、連続して撮影するときの初期化を省く。
+    open() / close() は呼び出し回数を数え、すべての利用者が close() するまでデバイスを閉じない
+    (複数アームの run_sequence が同時にカメラを使う場合のため)。
+    開いていなければ撮影のたびに開いて閉じる (別プロセスの capture と取り合わないように)。
+    """
+
+    def __init__(self, index=0, directory=DEFAULT_CAPTURE_DIR):
+        """
+        Args:
+            index (int): cv2.VideoCapture に渡すカメラ番号
+            directory (str): 画像の保存先
+        """
+        self.index = index
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.device = None
+        self.users = 0
+
+    def open(self):
+        with self.lock:
+            self.users += 1
+            if self.device is None:
+                self.device = cv2.VideoCapture(self.index)
+                # 開いたままにするので、古いフレームが溜まらないようにする
+                self.device.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+    def close(self):
+        """open() と対で呼ぶ。最後の利用者が閉じたときにデバイスを解放する"""
+        with self.lock:
+            if self.users == 0:
+                return
+            self.users -= 1
+            if self.users == 0 and self.device is not None:
+                self.device.release()
+                self.device = None
+
+    def capture(self):
+        """
+        撮影して画像のファイルパスを返す
+
+        Returns:
+            str or None: 画像のファイルパス。撮影できなかった場合は None
+        """
+        with self.lock:
+            device = self.device or cv2.VideoCapture(self.index)
+            try:
+                ret, frame = device.read()
+            finally:
+                if device is not self.device:
+                    device.release()
+        if not ret:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        file_name = os.path.join(self.directory, f"{uuid4()}.jpg")
+        cv2.imwrite(file_name, frame)
+        return file_name
@@ -0,0 +1,244 @@
+import hashlib
+import json
+import os
+import tempfile
+from collections import namedtuple
+
+import yaml
+
+from servo_constants import SO101_MOTORS
+
+# arms を書かない従来形式の .env.yaml で駆動するアーム名
+DEFAULT_ARM = "follower"
+# 検証・コンパイル済みの設定を保存するキャッシュファイルの拡張子
+CACHE_SUFFIX = ".cache"
+# キャッシュの形式を変えたら上げる
+CACHE_VERSION = 3
+
+
+class ConfigError(ValueError):
+    """.env.yaml の形式が不正"""
+
+
+class ArmCalibration(namedtuple("ArmCalibration", ["port", "names", "ids", "homing_offsets", "range_mins", "range_maxs"])):
+    """
+    1 アーム分のキャリブレーションをモーター ID 順の配列にまとめたもの
+
+    各フィールドは names と同じ順序のタプル (port を除く)。
+    """
+
+    def motor_ids(self):
+        """モーター名をキー、モーター ID を値とする辞書を返す"""
+        return dict(zip(self.names, self.ids))
+
+    def range_of(self, motor_name):
+        """モーターの可動範囲 (range_min, range_max) を返す"""
+        index = self.names.index(motor_name)
+        return self.range_mins[index], self.range_maxs[index]
+
+    @classmethod
+    def from_dict(cls, values):
+        """_asdict() を JSON にしたもの (タプルがリストになっている) から復元する"""
+        return cls(port=values['port'], **{field: tuple(values[field]) for field in cls._fields if field != 'port'})
+
+
+def arm_configs(config):
+    """
+    駆動するアームの設定を返す
+
+    .env.yaml に arms があればその全アームを、なければ従来どおり follower だけを返す。
+        arms:
+          left:
+            port: /dev/tty.usbmodem0001
+            calibration: {...}
+          right:
+            port: /dev/tty.usbmodem0002
+            calibration: {...}
+
+    Returns:
+        dict: アーム名をキー、アームの設定 (port, calibration など) を値とする辞書
+    """
+    if 'arms' in config:
+        return dict(config['arms'])
+    return {DEFAULT_ARM: config[DEFAULT_ARM]}
+
+
+def validate_config(config):
+    """
+    .env.yaml の形式を検証する。キャリブレーション途中のモーター (range_min などがない) は許容する
+
+    Raises:
+        ConfigError: 形式が不正な場合
+    """
+    if not isinstance(config, dict):
+        raise ConfigError(".env.yaml の最上位は辞書である必要があります")
+    if 'arms' in config:
+        if not isinstance(config['arms'], dict) or not config['arms']:
+            raise ConfigError("arms にはアーム名をキーとする設定を 1 つ以上書いてください")
+        sections = dict(config['arms'])
+    elif DEFAULT_ARM in config:
+        sections = {DEFAULT_ARM: config[DEFAULT_ARM]}
+    else:
+        raise ConfigError(f"arms または {DEFAULT_ARM} の設定がありません")
+    if 'leader' in config:
+        sections['leader'] = config['leader']
+
+    for arm_name, arm_config in sections.items():
+        if not isinstance(arm_config, dict):
+            raise ConfigError(f"{arm_name} の設定は辞書である必要があります")
+        if not isinstance(arm_config.get('port'), str):
+            raise ConfigError(f"{arm_name} に port がありません")
+        calibration = arm_config.get('calibration')
+        if calibration is None:
+            continue
+        if not isinstance(calibration, dict):
+            raise ConfigError(f"{arm_name}.calibration は辞書である必要があります")
+        ids = set()
+        for motor_name, motor_config in calibration.items():
+            if not isinstance(motor_config, dict) or not isinstance(motor_config.get('id'), int):
+                raise ConfigError(f"{arm_name}.calibration.{motor_name} に id がありません")
+            if motor_config['id'] in ids:
+                raise ConfigError(f"{arm_name}.calibration.{motor_name} の id {motor_config['id']} が重複しています")
+            ids.add(motor_config['id'])
+            for key in ('homing_offset', 'range_min', 'range_max'):
+                if key in motor_config and not isinstance(motor_config[key], int):
+                    raise ConfigError(f"{arm_name}.calibration.{motor_name}.{key} は整数である必要があります")
+            if 'range_min' in motor_config and 'range_max' in motor_config:
+                if not 0 <= motor_config['range_min'] <= motor_config['range_max'] <= 4095:
+                    raise ConfigError(f"{arm_name}.calibration.{motor_name} の可動範囲が不正です")
+
+
+def compile_arm(arm_config):
+    """
+    アームのキャリブレーションを ArmCalibration にまとめる
+
+    Returns:
+        ArmCalibration or None: キャリブレーションが終わっていないモーター (まだ書き込まれていないモーターを含む) がある場合は None
+    """
+    calibration = arm_config.get('calibration')
+    if not calibration or any(motor_name not in calibration for motor_name in SO101_MOTORS):
+        return None
+    names = sorted(calibration.keys(), key=lambda motor_name: calibration[motor_name]['id'])
+    if any('range_min' not in calibration[name] or 'range_max' not in calibration[name] for name in names):
+        return None
+    return ArmCalibration(
+        port=arm_config['port'],
+        names=tuple(names),
+        ids=tuple(calibration[name]['id'] for name in names),
+        homing_offsets=tuple(calibration[name].get('homing_offset', 0) for name in names),
+        range_mins=tuple(calibration[name]['range_min'] for name in names),
+        range_maxs=tuple(calibration[name]['range_max'] for name in names),
+    )
+
+
+def _load(env_file):
+    """
+    検証・コンパイル済みの設定を返す
+
+    .env.yaml のハッシュをキーにしたキャッシュがあれば YAML を解析せずにそれを使う。
+    キャッシュは JSON で保存し、読み込み時にコードを実行しうる形式 (pickle など) は使わない。
+    """
+    with open(env_file, 'rb') as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()
+    cache_file = env_file + CACHE_SUFFIX
+    try:
+        with open(cache_file, 'rb') as f:
+            cache = json.loads(f.read())
+        if cache.get('version') == CACHE_VERSION and cache.get('hash') == digest:
+            cache['arms'] = {
+                arm_name: ArmCalibration.from_dict(calibration) if calibration is not None else None
+                for arm_name, calibration in cache['arms'].items()
+            }
+            return cache
+    except (OSError, ValueError, TypeError, KeyError, AttributeError):
+        pass
+
+    config = yaml.safe_load(data)
+    validate_config(config)
+    arms = {arm_name: compile_arm(arm_config) for arm_name, arm_config in arm_configs(config).items()}
+    cache = {
+        'version': CACHE_VERSION,
+        'hash': digest,
+        'config': config,
+        'arms': {arm_name: calibration._asdict() if calibration is not None else None for arm_name, calibration in arms.items()},
+    }
+    try:
+        text = json.dumps(cache)
+        # 数値のキーや日付など JSON で元に戻らない値を含む設定はキャッシュしない
+        if json.loads(text)['config'] == config:
+            atomic_write(cache_file, text.encode())
+    except (OSError, ValueError, TypeError):
+        # キャッシュが書けなくても設定の読み込みには影響しない
+        pass
+    cache['arms'] = arms
+    return cache
+
+
+def load_config(env_file=".env.yaml"):
+    """.env.yaml を検証して読み込む"""
+    return _load(env_file)['config']
+
+
+def load_arms(env_file=".env.yaml"):
+    """
+    駆動するアームの設定とコンパイル済みキャリブレーションを返す
+
+    Returns:
+        dict: アーム名をキー、(アームの設定, ArmCalibration または None) を値とする辞書
+    """
+    cache = _load(env_file)
+    return {
+        arm_name: (arm_config, cache['arms'][arm_name])
+        for arm_name, arm_config in arm_configs(cache['config']).items()
+    }
+
+
+def atomic_write(path, data):
+    """一時ファイルに書いてから置き換えることで、途中で落ちても壊れたファイルを残さない"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        if os.path.exists(path):
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o777)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def save_config(config, env_file=".env.yaml"):
+    """設定を検証してアトミックに保存する"""
+    validate_config(config)
+    atomic_write(env_file, yaml.dump(config, default_flow_style=False).encode())
+
+
+def arm_section(config, arm_name):
+    """arms があれば arms 以下の、なければ最上位のアームの設定を返す"""
+    if 'arms' in config and arm_name in config['arms']:
+        return config['arms'][arm_name]
+    return config[arm_name]
+
+
+def update_joint_calibration(arm_name, motor_name, values, env_file=".env.yaml"):
+    """
+    1 関節分のキャリブレーションを .env.yaml に書き込む
+
+    書き込みのたびにファイルを読み直してその関節だけを更新し、アトミックに保存する。
+    キャリブレーション中に落ちても、それまでに終わった関節の結果は残る。
+
+    Args:
+        arm_name (str): アーム名
+        motor_name (str): モーター名
+        values (dict): id, homing_offset, range_min, range_max など
+    """
+    with open(env_file, 'r') as f:
+        config = yaml.safe_load(f)
+    section = arm_section(config, arm_name)
+    section.setdefault('calibration', {}).setdefault(motor_name, {}).update(values)
+    save_config(config, env_file)
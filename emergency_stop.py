@@ -1,32 +1,44 @@
-import yaml
-from scservo_sdk import PortHandler, PacketHandler
-from servo_constants import (
-    PROTOCOL_VERSION, BAUDRATE,
-    ADDR_PRESENT_POSITION, ADDR_GOAL_POSITION, ADDR_TORQUE_ENABLE
-)
-
-with open('.env.yaml', 'r') as f:
-    config = yaml.safe_load(f)
-
-portHandler = PortHandler(config['follower']['port'])
-packetHandler = PacketHandler(PROTOCOL_VERSION)
-portHandler.openPort()
-portHandler.setBaudRate(BAUDRATE)
-
-# 全モーターの目標位置を現在位置に設定してからトルクを無効にする
-for motor_name, motor_data in config['follower']['calibration'].items():
-    motor_id = motor_data['id']
-    
-    # 現在位置を取得
-    current_pos, _, _ = packetHandler.read2ByteTxRx(portHandler, motor_id, ADDR_PRESENT_POSITION)
-    
-    # 目標位置を現在位置に設定
-    packetHandler.write2ByteTxRx(portHandler, motor_id, ADDR_GOAL_POSITION, current_pos)
-    
-    # トルクを無効にする
-    packetHandler.write1ByteTxRx(portHandler, motor_id, ADDR_TORQUE_ENABLE, 0)
-    
-    print(f"{motor_name} pos={current_pos}, goal set to {current_pos}, torque disabled")
-
-portHandler.closePort()
-print("All motors stopped safely")
+from concurrent.futures import ThreadPoolExecutor
+from bus import ServoBus
+from config import load_config, arm_configs
+from estop import EmergencyStop, default_socket_path, request_stop
+
+
+def stop_arm(arm_name, arm_config):
+    port = arm_config['port']
+
+    # ポートを使用中のプロセス (MCP サーバーなど) があればソケット経由で停止を要求する
+    result = request_stop(arm_config.get('estop_socket', default_socket_path(port)))
+    if result is not None:
+        return result, "実行中のプロセスに停止を要求しました"
+
+    # 受け付けるプロセスがなければ自分でポートを開いて停止する
+    bus = ServoBus(port)
+    bus.open()
+    motor_ids = {motor_name: motor_data['id'] for motor_name, motor_data in arm_config['calibration'].items()}
+    result = EmergencyStop(bus, motor_ids).trigger("emergency_stop.py")
+    bus.close()
+    return result, "ポートを直接開いて停止しました"
+
+
+config = load_config()
+arms = arm_configs(config)
+
+# 全アームを並行して停止する
+with ThreadPoolExecutor(max_workers=len(arms)) as executor:
+    futures = {arm_name: executor.submit(stop_arm, arm_name, arm_config) for arm_name, arm_config in arms.items()}
+
+for arm_name, future in futures.items():
+    result, message = future.result()
+    print(f"=== {arm_name} ({arms[arm_name]['port']}) ===")
+    print(message)
+
+    for motor_name, position in result['positions'].items():
+        print(f"{motor_name} pos={position}, goal set to {position}, torque disabled")
+
+    print(f"トルク OFF 送信までの遅延: {result['last_latency_ms']:.3f} ms (最大 {result['worst_latency_ms']:.3f} ms)")
+    print(f"再送 (バス空き待ち) までの遅延: {result['last_confirm_latency_ms']:.3f} ms (最大 {result['worst_confirm_latency_ms']:.3f} ms)")
+    if result['sent'] or result['confirmed']:
+        print("All motors stopped safely")
+    else:
+        print("トルク OFF を送信できませんでした。電源を切ってください")
@@ -0,0 +1,212 @@
+import fcntl
+import json
+import os
+import signal
+import socket
+import threading
+import time
+
+from servo_constants import ADDR_PRESENT_POSITION, ADDR_GOAL_POSITION
+
+# 非常停止要求を受け付けるソケットへの接続タイムアウト [秒]
+SOCKET_TIMEOUT_SEC = 1.0
+# 非常停止の結果 (後処理を含む) を待つタイムアウト [秒]
+RESPONSE_TIMEOUT_SEC = 5.0
+
+
+class SocketInUseError(RuntimeError):
+    """非常停止ソケットを別のプロセスが使用中"""
+
+
+def default_socket_path(port):
+    """ポートごとの非常停止ソケットのパスを返す"""
+    return os.path.join("/tmp", f"so101-estop-{os.path.basename(port)}.sock")
+
+
+class EmergencyStop():
+    """
+    全モーターのトルクを最優先で切る非常停止
+
+    trigger() は実行中のトランザクションを待たずにトルク OFF のブロードキャストを 1 パケット送り、
+    その後バスが空いてからもう一度送って確実にする。目標位置の書き換えなどの後処理はその後に行う。
+    同じプロセス内からは trigger() を、別プロセスからはシグナル (SIGUSR1) か UNIX ソケットで要求できる。
+    """
+
+    def __init__(self, bus, motor_ids):
+        """
+        Args:
+            bus (ServoBus): モーターが接続されたバス
+            motor_ids (dict): モーター名をキー、モーター ID を値とする辞書
+        """
+        self.bus = bus
+        self.motor_ids = dict(motor_ids)
+        self.listeners = []
+        self.lock = threading.Lock()
+        self.count = 0
+        self.last_reason = None
+        self.last_time = None
+        self.last_latency_ms = None
+        self.worst_latency_ms = None
+        self.last_confirm_latency_ms = None
+        self.worst_confirm_latency_ms = None
+        self.server = None
+        self.socket_path = None
+        self.socket_lock = None
+
+    @property
+    def active(self):
+        return self.bus.halted
+
+    def add_listener(self, listener):
+        """非常停止後に呼ばれるコールバックを登録する (引数は現在位置の辞書)"""
+        self.listeners.append(listener)
+
+    def trigger(self, reason="manual"):
+        """
+        非常停止を実行する
+
+        Args:
+            reason (str): 非常停止の理由 (記録用)
+
+        Returns:
+            dict: 非常停止の結果と遅延の統計
+        """
+        start = time.perf_counter()
+        sent = self.bus.send_torque_off()
+        latency_ms = (time.perf_counter() - start) * 1000
+        confirmed = self.bus.send_torque_off(wait_idle=True)
+        confirm_latency_ms = (time.perf_counter() - start) * 1000
+
+        with self.lock:
+            self.count += 1
+            self.last_reason = reason
+            self.last_time = time.time()
+            self.last_latency_ms = latency_ms
+            self.last_confirm_latency_ms = confirm_latency_ms
+            if self.worst_latency_ms is None or latency_ms > self.worst_latency_ms:
+                self.worst_latency_ms = latency_ms
+            if self.worst_confirm_latency_ms is None or confirm_latency_ms > self.worst_confirm_latency_ms:
+                self.worst_confirm_latency_ms = confirm_latency_ms
+
+        # 後処理: 解除時に急に動かないよう目標位置を現在位置に合わせる
+        positions = {}
+        for motor_name, motor_id in self.motor_ids.items():
+            position = self.bus.read2(motor_id, ADDR_PRESENT_POSITION).value
+            if position is not None:
+                self.bus.write2(motor_id, ADDR_GOAL_POSITION, position)
+            positions[motor_name] = position
+        # STS シリーズは目標位置の書き込みでトルクが入ることがあるため、最後にもう一度トルクを切る
+        self.bus.send_torque_off(wait_idle=True)
+        for listener in self.listeners:
+            listener(positions)
+
+        result = self.stats()
+        result.update({"sent": sent, "confirmed": confirmed, "positions": positions})
+        return result
+
+    def reset(self):
+        """非常停止を解除してトルク ON を許可する (トルクは自動では入らない)"""
+        self.bus.clear_halt()
+
+    def stats(self):
+        """非常停止の状態と遅延の統計を返す"""
+        with self.lock:
+            return {
+                "active": self.active,
+                "count": self.count,
+                "last_reason": self.last_reason,
+                "last_time": self.last_time,
+                "last_latency_ms": self.last_latency_ms,
+                "worst_latency_ms": self.worst_latency_ms,
+                "last_confirm_latency_ms": self.last_confirm_latency_ms,
+                "worst_confirm_latency_ms": self.worst_confirm_latency_ms,
+            }
+
+    def install_signal_handler(self, signum=signal.SIGUSR1):
+        """シグナル受信で非常停止するハンドラを登録する"""
+        signal.signal(signum, self._signal_handler)
+
+    def _signal_handler(self, signum, frame):
+        # 割り込まれたトランザクションを壊さないよう、ハンドラ内ではトルク OFF の送信だけ行い
+        # 後処理を含む trigger() は別スレッドで実行する
+        self.bus.send_torque_off()
+        thread = threading.Thread(target=self.trigger, args=(f"signal {signum}",))
+        thread.daemon = True
+        thread.start()
+
+    def serve_socket(self, socket_path):
+        """
+        UNIX ソケットで非常停止要求を受け付けるスレッドを起動する
+
+        接続された時点で (何も受信しなくても) 非常停止し、結果を JSON 1 行で返す。
+        接続すると相手が非常停止してしまうため、使用中かどうかはソケットへの接続ではなく
+        ロックファイル (ソケットのパス + ".lock") で判定し、使用中のソケットは消さない。
+
+        Raises:
+            SocketInUseError: 別のプロセスが同じソケットで受け付けている場合
+        """
+        socket_lock = open(socket_path + ".lock", "w")
+        try:
+            fcntl.flock(socket_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            socket_lock.close()
+            raise SocketInUseError(f"{socket_path} は別のプロセスが使用中です。そのプロセスを終了してから起動してください")
+        self.socket_lock = socket_lock
+        # ロックが取れた = 前回のプロセスが残した古いソケット
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        self.socket_path = socket_path
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(socket_path)
+        self.server.listen(1)
+        thread = threading.Thread(target=self._serve_loop)
+        thread.daemon = True
+        thread.start()
+
+    def close_socket(self):
+        if self.server is None:
+            return
+        self.server.close()
+        self.server = None
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self.socket_lock.close()
+        self.socket_lock = None
+
+    def _serve_loop(self):
+        while self.server is not None:
+            try:
+                connection, _ = self.server.accept()
+            except OSError:
+                break
+            with connection:
+                result = self.trigger("socket")
+                try:
+                    connection.sendall((json.dumps(result) + "\n").encode())
+                except OSError:
+                    pass
+
+
+def request_stop(socket_path):
+    """
+    別プロセスの EmergencyStop に非常停止を要求する
+
+    Returns:
+        dict or None: 非常停止の結果。受け付けるプロセスがない場合は None
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(SOCKET_TIMEOUT_SEC)
+    try:
+        client.connect(socket_path)
+        client.settimeout(RESPONSE_TIMEOUT_SEC)
+        response = b""
+        while not response.endswith(b"\n"):
+            chunk = client.recv(4096)
+            if not chunk:
+                break
+            response += chunk
+        return json.loads(response) if response else None
+    except (OSError, ValueError):
+        return None
+    finally:
+        client.close()
@@ -0,0 +1,199 @@
+import math
+import os
+import threading
+
+import yaml
+
+from config import atomic_write, DEFAULT_ARM
+
+DEFAULT_POSES_FILE = "poses.yaml"
+
+# グリッパーのモーター名
+GRIPPER = "gripper"
+
+# 物の置き場所ごとの姿勢の初期値 (follower 用。poses.yaml に保存した姿勢があればそちらを使う)
+DEFAULT_POSES = {
+    "左上": {"shoulder_pan": 1687, "shoulder_lift": 2802, "elbow_flex": 1227, "wrist_flex": 2985, "wrist_roll": 2081},
+    "右上": {"shoulder_pan": 2313, "shoulder_lift": 2802, "elbow_flex": 1227, "wrist_flex": 2985, "wrist_roll": 2081},
+    "右下": {"shoulder_pan": 2600, "shoulder_lift": 2013, "elbow_flex": 2470, "wrist_flex": 2681, "wrist_roll": 2081},
+    "左下": {"shoulder_pan": 1246, "shoulder_lift": 2013, "elbow_flex": 2470, "wrist_flex": 2681, "wrist_roll": 2081},
+}
+
+# 対象の姿勢から真上に退避した姿勢 (hover) へのオフセットの初期値。
+# アームの設置に合わせて poses.yaml の hover_offset で上書きする
+DEFAULT_HOVER_OFFSET = {"shoulder_lift": -300}
+
+# マクロ: (姿勢, グリッパー) の手順のリスト
+#   姿勢: "target" は指定した姿勢、"hover" はその真上
+#   グリッパー: "open" / "close" で開閉、None はグリッパーを動かさない
+MACROS = {
+    "approach": [("hover", "open"), ("target", "open")],
+    "grasp": [("target", "close")],
+    "lift": [("hover", None)],
+    "pick": [("hover", "open"), ("target", "open"), ("target", "close"), ("hover", None)],
+    "place": [("hover", None), ("target", None), ("target", "open"), ("hover", "open")],
+}
+
+# 軌道の補間で 1 ウェイポイントあたりに動かす最大量 [tick]
+MAX_STEP_TICKS = 40
+
+# poses.yaml は複数アームの PoseLibrary で共有するため、ファイルのパスごとに 1 つのロックを使う
+_PATH_LOCKS = {}
+_PATH_LOCKS_LOCK = threading.Lock()
+
+
+def _path_lock(path):
+    with _PATH_LOCKS_LOCK:
+        return _PATH_LOCKS.setdefault(os.path.abspath(path), threading.Lock())
+
+
+class PoseLibrary():
+    """
+    アームごとの名前付き姿勢を poses.yaml に保存し、姿勢とマクロを軌道にコンパイルする
+
+    コンパイルした軌道はキャッシュし、姿勢を保存・削除したときに破棄する。
+    """
+
+    def __init__(self, arm_name, calibration, path=DEFAULT_POSES_FILE):
+        """
+        Args:
+            arm_name (str): アーム名 (poses.yaml の最上位のキー)
+            calibration (ArmCalibration): 可動範囲の確認とグリッパーの開閉位置に使う
+            path (str): 姿勢を保存するファイル
+        """
+        self.arm_name = arm_name
+        self.calibration = calibration
+        self.path = path
+        self.lock = _path_lock(path)
+        self.trajectories = {}
+        section = self._read().get(arm_name, {})
+        self.poses = dict(section.get('poses') or (DEFAULT_POSES if arm_name == DEFAULT_ARM else {}))
+        self.hover_offset = dict(section.get('hover_offset', DEFAULT_HOVER_OFFSET))
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, 'r') as f:
+            return yaml.safe_load(f) or {}
+
+    def _write(self):
+        # 他のアームの姿勢を消さないよう、ファイルを読み直してこのアームの分だけ書き換える
+        data = self._read()
+        data[self.arm_name] = {'poses': self.poses, 'hover_offset': self.hover_offset}
+        atomic_write(self.path, yaml.dump(data, default_flow_style=False, allow_unicode=True).encode())
+
+    def names(self):
+        return list(self.poses)
+
+    def get(self, name):
+        if name not in self.poses:
+            raise KeyError(f"姿勢 {name} はありません ({', '.join(self.poses)})")
+        return dict(self.poses[name])
+
+    def save(self, name, positions):
+        """姿勢を保存する (同じ名前があれば上書き)"""
+        self.validate(positions)
+        with self.lock:
+            self.poses[name] = dict(positions)
+            self.trajectories.clear()
+            self._write()
+
+    def delete(self, name):
+        """姿勢を削除する"""
+        with self.lock:
+            self.get(name)
+            del self.poses[name]
+            self.trajectories.clear()
+            self._write()
+
+    def validate(self, positions):
+        """可動範囲外の値があれば ValueError を送出する"""
+        errors = []
+        for motor_name, position in positions.items():
+            if motor_name not in self.calibration.names:
+                errors.append(f"{motor_name} というモーターはありません")
+                continue
+            range_min, range_max = self.calibration.range_of(motor_name)
+            if not range_min <= position <= range_max:
+                errors.append(f"{motor_name} の {position} は可動範囲 {range_min}-{range_max} の外です")
+        if errors:
+            raise ValueError(", ".join(errors))
+
+    def compile(self, macro, pose_name):
+        """
+        マクロを軌道にコンパイルする (キャッシュ済みならそれを返す)
+
+        Args:
+            macro (str): MACROS のキー。None の場合は姿勢へ移動するだけ
+            pose_name (str): 対象の姿勢
+
+        Returns:
+            list: セグメントのリスト。各セグメントはウェイポイント (モーター名をキー、目標位置を値とする辞書) のリストで、
+                  最後のウェイポイントで止まるまで待つ。最初のセグメントは最初の姿勢だけを含み、
+                  実行時に現在位置からの補間に置き換える (So101.run_trajectory)
+        """
+        key = (macro, pose_name)
+        with self.lock:
+            if key not in self.trajectories:
+                self.trajectories[key] = self._compile(macro, pose_name)
+            return self.trajectories[key]
+
+    def _compile(self, macro, pose_name):
+        if macro is not None and macro not in MACROS:
+            raise KeyError(f"マクロ {macro} はありません ({', '.join(MACROS)})")
+        target = self.get(pose_name)
+        steps = MACROS[macro] if macro is not None else [("target", GRIPPER if GRIPPER in target else None)]
+
+        keyframes = []
+        for pose, gripper in steps:
+            keyframe = dict(target)
+            if pose == "hover":
+                for motor_name, offset in self.hover_offset.items():
+                    keyframe[motor_name] += offset
+            keyframe.pop(GRIPPER, None)
+            if gripper is not None:
+                keyframe[GRIPPER] = self._gripper_position(gripper, target)
+            self.validate(keyframe)
+            keyframes.append(keyframe)
+
+        trajectory = [[keyframes[0]]]
+        for previous, keyframe in zip(keyframes, keyframes[1:]):
+            trajectory.append(interpolate(previous, keyframe))
+        return trajectory
+
+    def _gripper_position(self, gripper, target):
+        if gripper == GRIPPER:
+            return target[GRIPPER]
+        return gripper_position(self.calibration, gripper)
+
+
+def gripper_position(calibration, state):
+    """
+    グリッパーを開く・閉じるときの目標位置を返す
+
+    Args:
+        calibration (ArmCalibration): グリッパーの可動範囲を含むキャリブレーション
+        state (str): "open" または "close"
+
+    Returns:
+        int: 目標位置
+    """
+    range_min, range_max = calibration.range_of(GRIPPER)
+    # 数字が大きくなればグリッパーが開く
+    return range_max if state == "open" else range_min
+
+
+def interpolate(start, end, max_step=MAX_STEP_TICKS):
+    """
+    start から end まで関節空間で直線補間したウェイポイントのリストを返す (start は含まず end を含む)
+
+    start にないモーターは最初のウェイポイントから end の値にする。
+    """
+    steps = max([math.ceil(abs(position - start.get(motor_name, position)) / max_step) for motor_name, position in end.items()] + [1])
+    waypoints = []
+    for step in range(1, steps + 1):
+        waypoints.append({
+            motor_name: round(start.get(motor_name, position) + (position - start.get(motor_name, position)) * step / steps)
+            for motor_name, position in end.items()
+        })
+    return waypoints
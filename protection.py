@@ -0,0 +1,213 @@
+import threading
+import time
+from collections import deque
+
+from servo_constants import ADDR_GOAL_POSITION, ADDR_TORQUE_LIMIT, ADDR_TORQUE_ENABLE, ONE_BYTE_REGISTERS
+
+# ストール判定: 目標との差がこれ以上 [tick]
+STALL_POSITION_ERROR = 40
+# ストール判定: 負荷の絶対値がこれ以上 [0.1%]
+STALL_LOAD = 500
+# ストール判定: 電流がこれ以上 [mA]
+STALL_CURRENT = 800
+# ストール判定: 上記が続く時間 [秒] (取得周期に依存しないよう時間で判定する)
+STALL_DURATION_SEC = 0.5
+# 目標位置を戻すときも現在位置からこれだけ押し込んだままにする [tick] (掴んだ物を保持する力を残す)
+HOLD_MARGIN = 20
+# ストール継続時に設定するトルク上限 [0.1%]
+BACKOFF_TORQUE_LIMIT = 400
+# 起動時にトルク上限を読み出せなかった場合に戻す値 [0.1%]
+FULL_TORQUE_LIMIT = 1000
+# 温度上昇傾向を警戒し始める温度 [℃]
+WARN_TEMPERATURE = 55
+# この温度に達したらトルクを切る [℃]
+SHUTDOWN_TEMPERATURE = 65
+# 温度上昇傾向とみなす上昇率 [℃/分]
+TEMPERATURE_RISE_PER_MIN = 2.0
+# 温度上昇率を求める時間窓 [秒]
+TEMPERATURE_WINDOW_SEC = 30
+
+
+class ProtectionMonitor():
+    """
+    テレメトリを監視してストール・過負荷・過熱を検出し、該当関節を自動で保護する
+
+    対応は段階的に行う:
+        1. ストール検出 → トルク上限を下げる (掴んでいる物は弱い力で保持し続ける)
+        2. それでも負荷が続く → 目標位置を現在位置から HOLD_MARGIN だけ押し込んだ位置まで戻す
+        3. 過熱 (上昇傾向) → トルク上限を下げる、上限温度到達 → トルクを切る
+    """
+
+    def __init__(self, motors, history_size=100):
+        """
+        Args:
+            motors (dict): モーター名をキー、Motor を値とする辞書
+            history_size (int): 保持するイベント数
+        """
+        self.motors = motors
+        self.events = deque(maxlen=history_size)
+        self.lock = threading.Lock()
+        self.stall_since = {motor_name: None for motor_name in motors}
+        self.stage = {motor_name: 0 for motor_name in motors}
+        self.torque_limited = {motor_name: False for motor_name in motors}
+        self.shutdown = {motor_name: False for motor_name in motors}
+        self.temperatures = {motor_name: deque() for motor_name in motors}
+        # 解除時に戻すトルク上限 (起動時に設定されていた値。グリッパーなどで低く設定している場合がある)
+        self.torque_limits = {}
+        for motor_name, motor in motors.items():
+            torque_limit = motor.get_paramter(ADDR_TORQUE_LIMIT)
+            self.torque_limits[motor_name] = torque_limit if torque_limit is not None else FULL_TORQUE_LIMIT
+
+    def on_sample(self, sample):
+        """TelemetryCollector のリスナーとして 1 サンプルごとに呼ばれる"""
+        for motor_name, state in sample["motors"].items():
+            if motor_name not in self.motors:
+                continue
+            self._check_temperature(motor_name, state, sample["timestamp"])
+            self._check_stall(motor_name, state, sample["timestamp"])
+
+    def _check_stall(self, motor_name, state, timestamp):
+        motor = self.motors[motor_name]
+        if not motor.torque_enable or motor.goal_position is None or self.shutdown[motor_name]:
+            self.stall_since[motor_name] = None
+            return
+
+        position_error = abs(motor.goal_position - state["position"])
+        overloaded = abs(state["load"]) >= STALL_LOAD or state["current"] >= STALL_CURRENT
+        stalled = overloaded and not state["moving"] and (
+            position_error >= STALL_POSITION_ERROR or self.stage[motor_name] > 0
+        )
+        if not stalled:
+            self.stall_since[motor_name] = None
+            return
+
+        if self.stall_since[motor_name] is None:
+            self.stall_since[motor_name] = timestamp
+            return
+        if timestamp - self.stall_since[motor_name] < STALL_DURATION_SEC:
+            return
+        # 次の段階もここから STALL_DURATION_SEC 続いたら対応する
+        self.stall_since[motor_name] = timestamp
+
+        if self.stage[motor_name] == 0:
+            # 目標位置はそのままにして押し付ける力だけを弱める (グリッパーが物を落とさないように)
+            self._limit_torque(motor_name)
+            self.stage[motor_name] = 1
+            self._report(motor_name, "stall", "torque_limit", state,
+                         f"位置誤差 {position_error} / 負荷 {state['load']} のためトルク上限を {self._backoff_limit(motor_name)} に下げました")
+        elif self.stage[motor_name] == 1:
+            self.stage[motor_name] = 2
+            if position_error <= HOLD_MARGIN:
+                return
+            direction = 1 if motor.goal_position > state["position"] else -1
+            goal_position = state["position"] + direction * HOLD_MARGIN
+            motor.set_parameter(ADDR_GOAL_POSITION, goal_position)
+            motor.goal_position = goal_position
+            self._report(motor_name, "overload", "goal_backoff", state,
+                         f"トルク上限を下げても負荷 {state['load']} が続くため目標位置を {goal_position} まで戻しました")
+
+    def _check_temperature(self, motor_name, state, timestamp):
+        history = self.temperatures[motor_name]
+        history.append((timestamp, state["temperature"]))
+        while history and timestamp - history[0][0] > TEMPERATURE_WINDOW_SEC:
+            history.popleft()
+
+        if self.shutdown[motor_name]:
+            return
+
+        motor = self.motors[motor_name]
+        if state["temperature"] >= SHUTDOWN_TEMPERATURE:
+            motor.disable_torque()
+            self.shutdown[motor_name] = True
+            self._report(motor_name, "overheat", "torque_off", state,
+                         f"温度 {state['temperature']}℃ が上限 {SHUTDOWN_TEMPERATURE}℃ に達したためトルクを切りました")
+            return
+
+        if state["temperature"] < WARN_TEMPERATURE or self.torque_limited[motor_name] or len(history) < 2:
+            return
+        elapsed = history[-1][0] - history[0][0]
+        if elapsed < TEMPERATURE_WINDOW_SEC / 2:
+            return
+        rise_per_min = (history[-1][1] - history[0][1]) / elapsed * 60
+        if rise_per_min >= TEMPERATURE_RISE_PER_MIN:
+            self._limit_torque(motor_name)
+            self._report(motor_name, "overheat_trend", "torque_limit", state,
+                         f"温度 {state['temperature']}℃ が {rise_per_min:.1f}℃/分 で上昇中のためトルク上限を {self._backoff_limit(motor_name)} に下げました")
+
+    def _backoff_limit(self, motor_name):
+        # 元の上限が BACKOFF_TORQUE_LIMIT より低ければ上げない
+        return min(BACKOFF_TORQUE_LIMIT, self.torque_limits[motor_name])
+
+    def _limit_torque(self, motor_name):
+        self.motors[motor_name].set_parameter(ADDR_TORQUE_LIMIT, self._backoff_limit(motor_name))
+        self.torque_limited[motor_name] = True
+
+    def _report(self, motor_name, kind, action, state, message):
+        with self.lock:
+            self.events.append({
+                "timestamp": time.time(),
+                "motor": motor_name,
+                "event": kind,
+                "action": action,
+                "position": state["position"],
+                "load": state["load"],
+                "temperature": state["temperature"],
+                "message": message,
+            })
+
+    def clear(self, motor_name):
+        """
+        新しい目標位置が指令されたときに呼び、ストール対応を解除してトルク上限を戻す
+
+        過熱でトルクを切った関節は is_shutdown() が True の間は解除しない。
+        """
+        self.stall_since[motor_name] = None
+        self.stage[motor_name] = 0
+        if self.torque_limited[motor_name] and not self._is_hot(motor_name):
+            self.motors[motor_name].set_parameter(ADDR_TORQUE_LIMIT, self.torque_limits[motor_name])
+            self.torque_limited[motor_name] = False
+
+    def _is_hot(self, motor_name):
+        history = self.temperatures[motor_name]
+        return bool(history) and history[-1][1] >= WARN_TEMPERATURE
+
+    def is_shutdown(self, motor_name):
+        """過熱でトルクを切った関節で、まだ冷えていない場合 True"""
+        if self.shutdown[motor_name] and not self._is_hot(motor_name):
+            self.shutdown[motor_name] = False
+        return self.shutdown[motor_name]
+
+    def pop_events(self):
+        """記録されたイベントを取り出して消去する"""
+        with self.lock:
+            events = list(self.events)
+            self.events.clear()
+        return events
+
+
+class BusJoint():
+    """
+    Motor を使わずにバスを直接操作するクライアント (GUI など) が ProtectionMonitor に渡す関節
+
+    トルク状態と目標位置はクライアントが書き込むたびに更新する。
+    """
+
+    def __init__(self, bus, motor_id):
+        self.bus = bus
+        self.motor_id = motor_id
+        self.torque_enable = 0
+        self.goal_position = None
+
+    def set_parameter(self, address, parameter):
+        write = self.bus.write1 if address in ONE_BYTE_REGISTERS else self.bus.write2
+        write(self.motor_id, address, parameter)
+        return parameter
+
+    def get_paramter(self, address):
+        """Motor と同じ名前で、読み出せなかった場合は None を返す"""
+        read = self.bus.read1 if address in ONE_BYTE_REGISTERS else self.bus.read2
+        return read(self.motor_id, address).value
+
+    def disable_torque(self):
+        self.bus.write1(self.motor_id, ADDR_TORQUE_ENABLE, 0)
+        self.torque_enable = 0
@@ -1,4 +1,3 @@
-
 PROTOCOL_VERSION = 0
 
 # サーボモータのレジスタアドレス定数
@@ -11,8 +10,31 @@ ADDR_POSITION_I_GAIN = 23
 ADDR_OPERATING_MODE = 33
 ADDR_TORQUE_ENABLE = 40
 ADDR_GOAL_POSITION = 42
+ADDR_TORQUE_LIMIT = 48
 ADDR_LOCK = 55
 ADDR_PRESENT_POSITION = 56
+ADDR_PRESENT_VELOCITY = 58
+ADDR_PRESENT_LOAD = 60
+ADDR_PRESENT_VOLTAGE = 62
+ADDR_PRESENT_TEMPERATURE = 63
+ADDR_STATUS = 65
+ADDR_MOVING = 66
+ADDR_PRESENT_CURRENT = 69
+
+# 1 バイトのレジスタ (ここにないレジスタは 2 バイト)
+ONE_BYTE_REGISTERS = frozenset({
+    ADDR_ID, ADDR_POSITION_P_GAIN, ADDR_POSITION_D_GAIN, ADDR_POSITION_I_GAIN,
+    ADDR_OPERATING_MODE, ADDR_TORQUE_ENABLE, ADDR_LOCK,
+    ADDR_PRESENT_VOLTAGE, ADDR_PRESENT_TEMPERATURE, ADDR_STATUS, ADDR_MOVING,
+})
+
+# テレメトリ一括読み出し範囲 (Present_Position 〜 Present_Current の連続ブロック)
+TELEMETRY_START_ADDRESS = ADDR_PRESENT_POSITION
+TELEMETRY_DATA_LENGTH = ADDR_PRESENT_CURRENT + 2 - ADDR_PRESENT_POSITION
+
+# 符号ビット位置 (Feetech は符号付き値を符号ビット + 絶対値で表現する)
+SIGN_BIT_PRESENT_VELOCITY = 15
+SIGN_BIT_PRESENT_LOAD = 10
 
 # 通信設定
 BAUDRATE = 1000000
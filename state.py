@@ -0,0 +1,203 @@
+import threading
+import time
+
+from scservo_sdk import BROADCAST_ID
+from servo_constants import ADDR_TORQUE_ENABLE, ADDR_GOAL_POSITION
+from telemetry import TelemetryCollector, report_exception
+
+# 関節が動いている間の取得周期 [Hz]
+FAST_RATE_HZ = 50
+# 静止している間に下げていく取得周期の下限 [Hz]
+IDLE_RATE_HZ = 2
+# 周期を下げ始めるまでに必要な、静止した連続サンプル数
+IDLE_SAMPLES_BEFORE_BACKOFF = 10
+# キャッシュしたトルク状態を読み直すまでの時間 [秒] (モーター自身の保護でトルクが切れた場合に備える)
+TORQUE_CACHE_MAX_AGE_SEC = 10.0
+
+# 購読者へ通知する変化量の既定値。これ未満の変化は通知しない (0 は値が変われば通知する)
+DEFAULT_DEADBANDS = {
+    "position": 2,
+    "velocity": 10,
+    "load": 10,
+    "voltage": 0.2,
+    "temperature": 1,
+    "current": 13.0,
+    "moving": 0,
+    "torque_enabled": 0,
+}
+
+
+class StateService():
+    """
+    全モーターの状態を取得し、変化した値だけを購読者に通知する
+
+    関節が動いている間は FAST_RATE_HZ で取得し、静止が続くと IDLE_RATE_HZ まで周期を下げる。
+    移動中フラグ・速度に加えて前回からの位置の変化も見るため、トルク OFF で手で動かしている間も速い周期を保つ。
+    目標位置の書き込みがあればすぐに速い周期に戻す。
+    めったに変わらないトルク状態はキャッシュし、書き込みで無効になったときだけ読み直す。
+    """
+
+    def __init__(self, bus, motor_ids, fast_hz=FAST_RATE_HZ, idle_hz=IDLE_RATE_HZ):
+        """
+        Args:
+            bus (ServoBus): モーターが接続されたバス
+            motor_ids (dict): モーター名をキー、モーター ID を値とする辞書
+            fast_hz (float): 関節が動いている間の取得周期 [Hz]
+            idle_hz (float): 静止している間の取得周期の下限 [Hz]
+        """
+        self.bus = bus
+        self.motor_ids = dict(motor_ids)
+        self.motor_names = {motor_id: motor_name for motor_name, motor_id in self.motor_ids.items()}
+        self.telemetry = TelemetryCollector(bus, motor_ids)
+        self.fast_period = 1.0 / fast_hz
+        self.idle_period = 1.0 / idle_hz
+        self.period = self.fast_period
+        self.idle_samples = 0
+        self.previous_positions = {}
+        self.lock = threading.Lock()
+        self.state = {motor_name: {} for motor_name in self.motor_ids}
+        # トルク状態のキャッシュ (モーター名をキー、(値, 読み出した時刻) を値とする。ないものは無効)
+        self.torque_cache = {}
+        self.subscribers = []
+        self.wake = threading.Event()
+        self.running = False
+        self.thread = None
+        bus.add_write_listener(self._on_write)
+
+    def subscribe(self, callback, deadbands=None):
+        """
+        変化した値を受け取るコールバックを登録する
+
+        Args:
+            callback (callable): {モーター名: {項目名: 値}} を引数に呼ばれる。最初の呼び出しでは全項目を渡す
+            deadbands (dict): 項目名をキー、通知する最小の変化量を値とする辞書 (DEFAULT_DEADBANDS を上書きする)
+        """
+        with self.lock:
+            self.subscribers.append({
+                "callback": callback,
+                "deadbands": dict(DEFAULT_DEADBANDS, **(deadbands or {})),
+                "sent": {motor_name: {} for motor_name in self.motor_ids},
+            })
+
+    def snapshot(self):
+        """最新の全モーターの状態を返す"""
+        with self.lock:
+            return {motor_name: dict(values) for motor_name, values in self.state.items()}
+
+    def torque_enabled(self, motor_name):
+        """トルク状態を返す (キャッシュが無効なら読み直す。読み出せなかった場合は None)"""
+        self._refresh_torque([motor_name])
+        cached = self.torque_cache.get(motor_name)
+        return cached[0] if cached else None
+
+    def invalidate(self, motor_name=None):
+        """トルク状態のキャッシュを無効にする (motor_name が None なら全モーター)"""
+        if motor_name is None:
+            self.torque_cache.clear()
+        else:
+            self.torque_cache.pop(motor_name, None)
+        self.wake.set()
+
+    def _on_write(self, motor_id, address):
+        if address == ADDR_TORQUE_ENABLE:
+            self.invalidate(None if motor_id == BROADCAST_ID else self.motor_names.get(motor_id))
+        elif address == ADDR_GOAL_POSITION:
+            # 動き始めを取りこぼさないよう速い周期に戻す
+            self.boost()
+
+    def boost(self):
+        """静止していても速い周期に戻し、すぐに次の状態を取得する"""
+        self.period = self.fast_period
+        self.idle_samples = 0
+        self.wake.set()
+
+    def _refresh_torque(self, motor_names):
+        now = time.monotonic()
+        for motor_name in motor_names:
+            cached = self.torque_cache.get(motor_name)
+            if cached is not None and now - cached[1] < TORQUE_CACHE_MAX_AGE_SEC:
+                continue
+            result = self.bus.read1(self.motor_ids[motor_name], ADDR_TORQUE_ENABLE)
+            if result.ok:
+                self.torque_cache[motor_name] = (bool(result.value), now)
+
+    def poll_once(self):
+        """
+        状態を 1 回取得し、変化した値を購読者に通知して次の取得周期を決める
+
+        Returns:
+            dict or None: テレメトリのサンプル (通信失敗時は None)
+        """
+        sample = self.telemetry.read_once()
+        self._refresh_torque(self.motor_ids)
+
+        with self.lock:
+            if sample is not None:
+                for motor_name, values in sample["motors"].items():
+                    self.state[motor_name].update(values)
+            for motor_name, (torque_enabled, _) in list(self.torque_cache.items()):
+                self.state[motor_name]["torque_enabled"] = torque_enabled
+            notifications = [(subscriber["callback"], self._changes(subscriber)) for subscriber in self.subscribers]
+
+        for callback, changes in notifications:
+            if changes:
+                callback(changes)
+
+        if sample is not None:
+            if self._is_active(sample):
+                self.period = self.fast_period
+                self.idle_samples = 0
+            else:
+                self.idle_samples += 1
+                if self.idle_samples >= IDLE_SAMPLES_BEFORE_BACKOFF:
+                    self.period = min(self.period * 2, self.idle_period)
+        return sample
+
+    def _is_active(self, sample):
+        # 手で動かしたときは移動中フラグが立たないことがあるため、速度と位置の変化も見る
+        active = False
+        for motor_name, values in sample["motors"].items():
+            previous = self.previous_positions.get(motor_name)
+            if values["moving"] or values["velocity"] != 0 or (
+                previous is not None and abs(values["position"] - previous) >= DEFAULT_DEADBANDS["position"]
+            ):
+                active = True
+            self.previous_positions[motor_name] = values["position"]
+        return active
+
+    def _changes(self, subscriber):
+        changes = {}
+        for motor_name, values in self.state.items():
+            sent = subscriber["sent"][motor_name]
+            for key, value in values.items():
+                if key in sent and abs(value - sent[key]) < max(subscriber["deadbands"].get(key, 0), 1e-9):
+                    continue
+                sent[key] = value
+                changes.setdefault(motor_name, {})[key] = value
+        return changes
+
+    def start(self):
+        """バックグラウンドスレッドで状態の取得を始める"""
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.wake.set()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(timeout=1.0)
+        self.thread = None
+
+    def _loop(self):
+        while self.running:
+            self.wake.clear()
+            try:
+                self.poll_once()
+            except Exception as e:
+                report_exception(self.bus, "状態の取得", e)
+            # 書き込みがあれば待たずに次の取得へ進む
+            self.wake.wait(self.period)
@@ -0,0 +1,128 @@
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+from scservo_sdk import SCS_TOHOST
+from servo_constants import (
+    TELEMETRY_START_ADDRESS, TELEMETRY_DATA_LENGTH,
+    ADDR_PRESENT_POSITION, ADDR_PRESENT_VELOCITY, ADDR_PRESENT_LOAD,
+    ADDR_PRESENT_VOLTAGE, ADDR_PRESENT_TEMPERATURE, ADDR_MOVING,
+    ADDR_PRESENT_CURRENT,
+    SIGN_BIT_PRESENT_VELOCITY, SIGN_BIT_PRESENT_LOAD,
+)
+
+# Present_Current の 1 単位あたりの電流 [mA]
+CURRENT_UNIT_MA = 6.5
+
+
+def report_exception(bus, where, exception):
+    """バックグラウンドスレッドで起きた例外を握りつぶさず stderr とバスの health() に残す"""
+    traceback.print_exception(exception, file=sys.stderr)
+    bus.record_exception(f"{where}で例外が発生しました: {exception!r}")
+
+
+class TelemetryCollector():
+    """
+    全モーターのテレメトリを 1 回の sync-read で読み出し、リングバッファに保持する
+
+    Present_Position から Present_Current までの連続ブロックを一括で読むため、
+    バス上のコストは位置だけを読む場合とほぼ変わらない。
+    """
+
+    def __init__(self, bus, motor_ids, history_size=500):
+        """
+        Args:
+            bus (ServoBus): モーターが接続されたバス
+            motor_ids (dict): モーター名をキー、モーター ID を値とする辞書
+            history_size (int): リングバッファに保持するサンプル数
+        """
+        self.bus = bus
+        self.motor_ids = dict(motor_ids)
+        self.group = bus.make_sync_read(TELEMETRY_START_ADDRESS, TELEMETRY_DATA_LENGTH, self.motor_ids.values())
+        self.buffer = deque(maxlen=history_size)
+        self.listeners = []
+        self.running = False
+        self.thread = None
+
+    def read_once(self):
+        """
+        全モーターのテレメトリを 1 回読み出してリングバッファに追加する
+
+        Returns:
+            dict or None: 成功時はサンプル、通信失敗時は None
+        """
+        if not self.bus.sync_read(self.group).ok:
+            return None
+
+        sample = {"timestamp": time.time(), "motors": {}}
+        for motor_name, motor_id in self.motor_ids.items():
+            if not self.group.isAvailable(motor_id, TELEMETRY_START_ADDRESS, TELEMETRY_DATA_LENGTH):
+                return None
+            sample["motors"][motor_name] = self._decode(motor_id)
+
+        self.buffer.append(sample)
+        for listener in self.listeners:
+            # 1 つのリスナー (保護の判定など) の例外で他のリスナーを止めない
+            try:
+                listener(sample)
+            except Exception as e:
+                report_exception(self.bus, "テレメトリのリスナー", e)
+        return sample
+
+    def _decode(self, motor_id):
+        get = self.group.getData
+        return {
+            "position": get(motor_id, ADDR_PRESENT_POSITION, 2),
+            "velocity": SCS_TOHOST(get(motor_id, ADDR_PRESENT_VELOCITY, 2), SIGN_BIT_PRESENT_VELOCITY),
+            "load": SCS_TOHOST(get(motor_id, ADDR_PRESENT_LOAD, 2), SIGN_BIT_PRESENT_LOAD),
+            "voltage": get(motor_id, ADDR_PRESENT_VOLTAGE, 1) / 10,
+            "temperature": get(motor_id, ADDR_PRESENT_TEMPERATURE, 1),
+            "current": get(motor_id, ADDR_PRESENT_CURRENT, 2) * CURRENT_UNIT_MA,
+            "moving": bool(get(motor_id, ADDR_MOVING, 1)),
+        }
+
+    def add_listener(self, listener):
+        """サンプル取得ごとに呼ばれるコールバックを登録する"""
+        self.listeners.append(listener)
+
+    def latest(self):
+        """最新のサンプルを返す (未取得の場合は None)"""
+        return self.buffer[-1] if self.buffer else None
+
+    def history(self, count=None):
+        """古い順に最大 count 件のサンプルを返す"""
+        samples = list(self.buffer)
+        if count is not None:
+            samples = samples[-count:]
+        return samples
+
+    def start(self, rate_hz=50):
+        """バックグラウンドスレッドで rate_hz の周期でテレメトリを収集する"""
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._loop, args=(1.0 / rate_hz,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(timeout=1.0)
+        self.thread = None
+
+    def _loop(self, period):
+        next_time = time.monotonic()
+        while self.running:
+            try:
+                self.read_once()
+            except Exception as e:
+                report_exception(self.bus, "テレメトリの収集", e)
+            next_time += period
+            delay = next_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_time = time.monotonic()
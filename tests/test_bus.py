@@ -0,0 +1,129 @@
+import pytest
+from scservo_sdk import COMM_SUCCESS, COMM_RX_TIMEOUT
+
+import bus as bus_module
+from bus import ServoBus, COMM_HALTED, HEALTH_OK, HEALTH_DEGRADED, HEALTH_DISCONNECTED
+from servo_constants import ADDR_TORQUE_ENABLE, ADDR_GOAL_POSITION, ADDR_PRESENT_POSITION
+
+
+class FakePacketHandler():
+    """read2 / write1 / write2 の結果を results の順に返すパケットハンドラ"""
+
+    def __init__(self, results=()):
+        self.results = list(results)
+        self.calls = []
+
+    def _next(self):
+        return self.results.pop(0) if self.results else COMM_SUCCESS
+
+    def read2ByteTxRx(self, port, motor_id, address):
+        self.calls.append(("read2", motor_id, address))
+        return 2048, self._next(), 0
+
+    def write1ByteTxRx(self, port, motor_id, address, value):
+        self.calls.append(("write1", motor_id, address, value))
+        return self._next(), 0
+
+    def write2ByteTxRx(self, port, motor_id, address, value):
+        self.calls.append(("write2", motor_id, address, value))
+        return self._next(), 0
+
+    def getTxRxResult(self, result):
+        return f"comm {result}"
+
+
+class FakeSerial():
+    def reset_input_buffer(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def bus(monkeypatch):
+    servo_bus = ServoBus("COM_TEST", retries=2)
+    servo_bus.opens = 0
+
+    def open_port():
+        servo_bus.opens += 1
+        servo_bus.portHandler.ser = FakeSerial()
+        return True
+
+    monkeypatch.setattr(servo_bus.portHandler, "openPort", open_port)
+    monkeypatch.setattr(servo_bus.portHandler, "setBaudRate", lambda baudrate: True)
+    servo_bus.packetHandler = FakePacketHandler()
+    servo_bus.open()
+    return servo_bus
+
+
+@pytest.mark.parametrize("results, ok, retried", [
+    ([], True, 0),
+    ([COMM_RX_TIMEOUT], True, 1),
+    ([COMM_RX_TIMEOUT, COMM_RX_TIMEOUT], True, 2),
+    ([COMM_RX_TIMEOUT] * 3, False, 2),
+])
+def test_retry_counting(bus, results, ok, retried):
+    bus.packetHandler = FakePacketHandler(results)
+
+    result = bus.read2(1, ADDR_PRESENT_POSITION)
+
+    assert result.ok == ok
+    assert (result.value == 2048) == ok
+    assert bus.retried == retried
+    assert len(bus.packetHandler.calls) == retried + 1
+    assert bus.transactions == 1
+    assert bus.failures == (0 if ok else 1)
+
+
+def test_servo_timeouts_degrade_without_reopening_the_port(bus):
+    bus.packetHandler = FakePacketHandler([COMM_RX_TIMEOUT] * 30)
+    for _ in range(10):
+        bus.read2(1, ADDR_PRESENT_POSITION)
+
+    assert bus.state() == HEALTH_DEGRADED
+    assert bus.reconnects == 0 and bus.opens == 1
+
+    bus.read2(1, ADDR_PRESENT_POSITION)
+    assert bus.state() == HEALTH_OK
+
+
+def test_reconnect_is_throttled(bus, monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(bus_module.time, "monotonic", lambda: now[0])
+
+    assert bus.reconnect()
+    assert bus.reconnect()
+    assert bus.opens == 2 and bus.reconnects == 1
+
+    now[0] += bus_module.RECONNECT_INTERVAL_SEC
+    assert bus.reconnect()
+    assert bus.opens == 3 and bus.reconnects == 2
+
+
+def test_closed_port_is_not_reopened(bus):
+    bus.close()
+
+    result = bus.read2(1, ADDR_PRESENT_POSITION)
+
+    assert not result.ok
+    assert bus.opens == 1
+    assert bus.state() == HEALTH_DISCONNECTED
+    assert "開いていません" in bus.describe(result)
+
+
+def test_halt_blocks_only_torque_on(bus, monkeypatch):
+    monkeypatch.setattr(bus, "_write_raw", lambda packet: True)
+    bus.send_torque_off()
+
+    blocked = bus.write1(1, ADDR_TORQUE_ENABLE, 1)
+    assert blocked.comm_result == COMM_HALTED
+    assert bus.sync_write2(ADDR_TORQUE_ENABLE, {1: 1, 2: 0}).comm_result == COMM_HALTED
+    assert bus.packetHandler.calls == []
+    assert "非常停止中" in bus.describe(blocked)
+
+    assert bus.write1(1, ADDR_TORQUE_ENABLE, 0).ok
+    assert bus.write2(1, ADDR_GOAL_POSITION, 2048).ok
+
+    bus.clear_halt()
+    assert bus.write1(1, ADDR_TORQUE_ENABLE, 1).ok
@@ -0,0 +1,40 @@
+import camera
+
+
+class FakeVideoCapture():
+    opened = 0
+
+    def __init__(self, index):
+        FakeVideoCapture.opened += 1
+        self.released = False
+
+    def set(self, prop, value):
+        pass
+
+    def read(self):
+        return True, None
+
+    def release(self):
+        self.released = True
+
+
+def test_device_stays_open_until_last_user_closes(monkeypatch):
+    monkeypatch.setattr(camera.cv2, "VideoCapture", FakeVideoCapture)
+    FakeVideoCapture.opened = 0
+    cam = camera.Camera()
+
+    # 2 つのアームの run_sequence が重なって使う
+    cam.open()
+    cam.open()
+    device = cam.device
+    cam.close()
+    assert cam.device is device and not device.released
+
+    cam.close()
+    assert cam.device is None and device.released
+    assert FakeVideoCapture.opened == 1
+
+    # 対になっていない close() は無視する
+    cam.close()
+    cam.open()
+    assert cam.users == 1
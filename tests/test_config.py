@@ -0,0 +1,55 @@
+import json
+
+import yaml
+
+from config import load_arms, update_joint_calibration, DEFAULT_ARM, CACHE_SUFFIX
+from servo_constants import SO101_MOTORS
+
+
+def calibrate(env_file, motor_names):
+    for motor_name in motor_names:
+        update_joint_calibration(DEFAULT_ARM, motor_name, {
+            'id': SO101_MOTORS[motor_name],
+            'homing_offset': 0,
+            'range_min': 1000,
+            'range_max': 3000,
+        }, env_file)
+
+
+def test_partial_calibration_is_not_compiled(tmp_path):
+    env_file = str(tmp_path / ".env.yaml")
+    with open(env_file, 'w') as f:
+        yaml.safe_dump({DEFAULT_ARM: {'port': '/dev/ttyACM0'}}, f)
+
+    # 最初の関節だけ終わって止まった状態
+    calibrate(env_file, ["shoulder_pan"])
+    assert load_arms(env_file)[DEFAULT_ARM][1] is None
+
+    calibrate(env_file, list(SO101_MOTORS)[1:])
+    calibration = load_arms(env_file)[DEFAULT_ARM][1]
+    assert calibration.names == tuple(SO101_MOTORS)
+    assert calibration.range_of("gripper") == (1000, 3000)
+
+
+def test_cache_is_json_and_restores_calibration(tmp_path):
+    env_file = str(tmp_path / ".env.yaml")
+    with open(env_file, 'w') as f:
+        yaml.safe_dump({DEFAULT_ARM: {'port': '/dev/ttyACM0'}}, f)
+    calibrate(env_file, list(SO101_MOTORS))
+
+    compiled = load_arms(env_file)[DEFAULT_ARM][1]
+    with open(env_file + CACHE_SUFFIX) as f:
+        assert json.load(f)['arms'][DEFAULT_ARM]['names'] == list(SO101_MOTORS)
+
+    # 2 回目はキャッシュから読み、タプルに戻っている
+    cached = load_arms(env_file)[DEFAULT_ARM][1]
+    assert cached == compiled and isinstance(cached.ids, tuple)
+
+
+def test_config_that_does_not_survive_json_is_not_cached(tmp_path):
+    env_file = str(tmp_path / ".env.yaml")
+    with open(env_file, 'w') as f:
+        yaml.safe_dump({DEFAULT_ARM: {'port': '/dev/ttyACM0'}, 'notes': {1: 'numeric key'}}, f)
+
+    assert load_arms(env_file)[DEFAULT_ARM][1] is None
+    assert not (tmp_path / (".env.yaml" + CACHE_SUFFIX)).exists()
@@ -0,0 +1,65 @@
+import os
+
+import pytest
+
+from bus import ServoBus, TORQUE_OFF_PACKET
+from estop import EmergencyStop, SocketInUseError
+from servo_constants import SO101_MOTORS
+
+
+class RecordingPacketHandler():
+    """バスに送られたフレームを frames に順に記録するパケットハンドラ"""
+
+    def __init__(self, frames):
+        self.frames = frames
+
+    def read2ByteTxRx(self, port, motor_id, address):
+        self.frames.append(("read2", motor_id, address))
+        return 2048, 0, 0
+
+    def write2ByteTxRx(self, port, motor_id, address, value):
+        self.frames.append(("write2", motor_id, address, value))
+        return 0, 0
+
+
+@pytest.fixture
+def frames():
+    return []
+
+
+@pytest.fixture
+def bus(monkeypatch, frames):
+    servo_bus = ServoBus("COM_TEST")
+    servo_bus.is_open = True
+    servo_bus.packetHandler = RecordingPacketHandler(frames)
+    monkeypatch.setattr(servo_bus, "_write_raw", lambda packet: frames.append(packet) or True)
+    return servo_bus
+
+
+def test_trigger_ends_with_torque_off(bus, frames):
+    estop = EmergencyStop(bus, SO101_MOTORS)
+
+    result = estop.trigger("test")
+
+    # 目標位置を書き直した後もトルクが切れたままになるよう、最後のフレームはトルク OFF
+    assert any(frame[0] == "write2" for frame in frames[:-1])
+    assert frames[-1] == TORQUE_OFF_PACKET
+    assert result["active"] and result["positions"]["gripper"] == 2048
+
+
+def test_socket_in_use_is_not_taken_over(bus, tmp_path):
+    socket_path = str(tmp_path / "estop.sock")
+    first = EmergencyStop(bus, SO101_MOTORS)
+    second = EmergencyStop(bus, SO101_MOTORS)
+    first.serve_socket(socket_path)
+    try:
+        with pytest.raises(SocketInUseError):
+            second.serve_socket(socket_path)
+        assert os.path.exists(socket_path)
+    finally:
+        first.close_socket()
+
+    # 古いソケットが残っていても、使用中でなければ置き換えて起動する
+    open(socket_path, "w").close()
+    second.serve_socket(socket_path)
+    second.close_socket()
@@ -0,0 +1,47 @@
+import threading
+
+import yaml
+
+from config import ArmCalibration
+from poses import PoseLibrary
+
+CALIBRATION = ArmCalibration(
+    port="/dev/ttyACM0",
+    names=("shoulder_pan", "gripper"),
+    ids=(1, 6),
+    homing_offsets=(0, 0),
+    range_mins=(0, 1000),
+    range_maxs=(4095, 3000),
+)
+
+
+def test_concurrent_saves_from_different_arms_keep_both(tmp_path):
+    path = str(tmp_path / "poses.yaml")
+    libraries = [PoseLibrary(f"arm{index}", CALIBRATION, path) for index in range(8)]
+
+    threads = [
+        threading.Thread(target=library.save, args=("home", {"shoulder_pan": 2048 + index}))
+        for index, library in enumerate(libraries)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with open(path) as f:
+        data = yaml.safe_load(f)
+    assert {arm_name: section["poses"]["home"]["shoulder_pan"] for arm_name, section in data.items()} == {
+        f"arm{index}": 2048 + index for index in range(8)
+    }
+
+
+def test_delete_removes_pose_from_file(tmp_path):
+    path = str(tmp_path / "poses.yaml")
+    library = PoseLibrary("left", CALIBRATION, path)
+    library.save("home", {"shoulder_pan": 2048})
+    library.save("away", {"shoulder_pan": 1000})
+
+    library.delete("home")
+
+    assert library.names() == ["away"]
+    assert PoseLibrary("left", CALIBRATION, path).names() == ["away"]
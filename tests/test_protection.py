@@ -0,0 +1,133 @@
+import pytest
+
+from protection import (
+    ProtectionMonitor, STALL_DURATION_SEC, HOLD_MARGIN,
+    BACKOFF_TORQUE_LIMIT, FULL_TORQUE_LIMIT, SHUTDOWN_TEMPERATURE,
+)
+from servo_constants import ADDR_GOAL_POSITION, ADDR_TORQUE_LIMIT
+
+
+class FakeMotor():
+    """書き込んだレジスタを記録するだけの Motor"""
+
+    def __init__(self, goal_position, torque_limit=1000):
+        self.torque_enable = 1
+        self.goal_position = goal_position
+        self.registers = {ADDR_TORQUE_LIMIT: torque_limit}
+        self.writes = []
+
+    def set_parameter(self, address, parameter):
+        self.writes.append((address, parameter))
+        self.registers[address] = parameter
+        return parameter
+
+    def get_paramter(self, address):
+        return self.registers.get(address)
+
+    def disable_torque(self):
+        self.torque_enable = 0
+
+
+def sample(timestamp, position=2200, load=700, moving=False, temperature=35):
+    return {
+        "timestamp": timestamp,
+        "motors": {
+            "gripper": {
+                "position": position,
+                "velocity": 0,
+                "load": load,
+                "voltage": 12.0,
+                "temperature": temperature,
+                "current": 100.0,
+                "moving": moving,
+            },
+        },
+    }
+
+
+# 物を掴んで閉じきれないグリッパー (目標 1600 / 現在 2200) に対する段階的な保護
+# (時刻, 負荷, 期待する書き込み, 期待する段階, 期待するイベント)
+STALL_SEQUENCE = [
+    (0.0, 700, [], 0, None),
+    (STALL_DURATION_SEC / 2, 700, [], 0, None),
+    # 負荷が一度下がると判定をやり直す
+    (STALL_DURATION_SEC, 100, [], 0, None),
+    (1.0, 700, [], 0, None),
+    # まずはトルク上限だけを下げ、目標位置は変えない (保持力を残す)
+    (1.0 + STALL_DURATION_SEC, 700, [(ADDR_TORQUE_LIMIT, BACKOFF_TORQUE_LIMIT)], 1, ("stall", "torque_limit")),
+    (1.0 + STALL_DURATION_SEC * 1.5, 700, [], 1, None),
+    # それでも続けば目標位置を現在位置から HOLD_MARGIN だけ押し込んだ位置まで戻す
+    (1.0 + STALL_DURATION_SEC * 2, 700, [(ADDR_GOAL_POSITION, 2200 - HOLD_MARGIN)], 2, ("overload", "goal_backoff")),
+    # 以後は何もしない
+    (1.0 + STALL_DURATION_SEC * 4, 700, [], 2, None),
+]
+
+
+def test_stall_sequence_keeps_holding_force_then_clear_restores():
+    motor = FakeMotor(goal_position=1600)
+    monitor = ProtectionMonitor({"gripper": motor})
+
+    for timestamp, load, writes, stage, event in STALL_SEQUENCE:
+        del motor.writes[:]
+        monitor.on_sample(sample(timestamp, load=load))
+        assert motor.writes == writes, timestamp
+        assert monitor.stage["gripper"] == stage, timestamp
+        events = monitor.pop_events()
+        assert [(e["event"], e["action"]) for e in events] == ([event] if event else []), timestamp
+
+    assert motor.goal_position == 2200 - HOLD_MARGIN
+    # 目標位置が戻るのは現在位置より目標の側 (閉じる方向) で、トルクは切らない
+    assert motor.torque_enable == 1
+
+    del motor.writes[:]
+    monitor.clear("gripper")
+    assert motor.writes == [(ADDR_TORQUE_LIMIT, FULL_TORQUE_LIMIT)]
+    assert monitor.stage["gripper"] == 0
+
+
+@pytest.mark.parametrize("torque_enable, goal_position, position, moving", [
+    (0, 1600, 2200, False),   # トルク OFF
+    (1, None, 2200, False),   # 目標位置が未設定
+    (1, 2190, 2200, False),   # 目標位置に届いている
+    (1, 1600, 2200, True),    # 動いている
+])
+def test_no_stall(torque_enable, goal_position, position, moving):
+    motor = FakeMotor(goal_position=goal_position)
+    motor.torque_enable = torque_enable
+    monitor = ProtectionMonitor({"gripper": motor})
+
+    for step in range(10):
+        monitor.on_sample(sample(step * STALL_DURATION_SEC, position=position, moving=moving))
+
+    assert motor.writes == []
+    assert monitor.pop_events() == []
+
+
+def test_overheat_disables_torque_and_blocks_until_cool():
+    motor = FakeMotor(goal_position=2048)
+    monitor = ProtectionMonitor({"gripper": motor})
+
+    monitor.on_sample(sample(0.0, position=2048, load=0, temperature=SHUTDOWN_TEMPERATURE))
+    assert motor.torque_enable == 0
+    assert monitor.is_shutdown("gripper")
+    assert [e["action"] for e in monitor.pop_events()] == ["torque_off"]
+
+    monitor.on_sample(sample(1.0, position=2048, load=0, temperature=40))
+    assert not monitor.is_shutdown("gripper")
+
+
+@pytest.mark.parametrize("configured, backoff", [
+    (1000, BACKOFF_TORQUE_LIMIT),
+    (600, BACKOFF_TORQUE_LIMIT),
+    (300, 300),   # 元の上限より上げない
+])
+def test_clear_restores_configured_torque_limit(configured, backoff):
+    motor = FakeMotor(goal_position=1600, torque_limit=configured)
+    monitor = ProtectionMonitor({"gripper": motor})
+
+    monitor.on_sample(sample(0.0))
+    monitor.on_sample(sample(STALL_DURATION_SEC))
+    assert motor.registers[ADDR_TORQUE_LIMIT] == backoff
+
+    monitor.clear("gripper")
+    assert motor.registers[ADDR_TORQUE_LIMIT] == configured
@@ -0,0 +1,84 @@
+from collections import namedtuple
+
+import pytest
+
+from state import StateService, IDLE_SAMPLES_BEFORE_BACKOFF, DEFAULT_DEADBANDS
+from servo_constants import ADDR_PRESENT_POSITION, ADDR_PRESENT_VELOCITY, ADDR_MOVING, ADDR_GOAL_POSITION
+
+Result = namedtuple("Result", ["ok", "value"])
+
+
+class FakeGroup():
+    """registers の値をそのまま返す sync-read"""
+
+    def __init__(self):
+        self.registers = {ADDR_PRESENT_POSITION: 2048}
+
+    def isAvailable(self, motor_id, address, length):
+        return True
+
+    def getData(self, motor_id, address, length):
+        return self.registers.get(address, 0)
+
+
+class FakeBus():
+    def __init__(self):
+        self.group = FakeGroup()
+        self.write_listeners = []
+
+    def make_sync_read(self, start_address, data_length, motor_ids):
+        return self.group
+
+    def sync_read(self, group):
+        return Result(ok=True, value=None)
+
+    def read1(self, motor_id, address):
+        return Result(ok=True, value=0)
+
+    def add_write_listener(self, listener):
+        self.write_listeners.append(listener)
+
+
+def settle(service):
+    for _ in range(IDLE_SAMPLES_BEFORE_BACKOFF + 10):
+        service.poll_once()
+    assert service.period == service.idle_period
+
+
+@pytest.mark.parametrize("address, value", [
+    (ADDR_MOVING, 1),
+    (ADDR_PRESENT_VELOCITY, 5),
+    # トルク OFF で手で動かしたとき (移動中フラグも速度も立たない)
+    (ADDR_PRESENT_POSITION, 2048 + DEFAULT_DEADBANDS["position"]),
+])
+def test_activity_returns_to_fast_rate(address, value):
+    bus = FakeBus()
+    service = StateService(bus, {"gripper": 6})
+    settle(service)
+
+    bus.group.registers[address] = value
+    service.poll_once()
+
+    assert service.period == service.fast_period
+
+
+def test_position_noise_within_deadband_keeps_idle_rate():
+    bus = FakeBus()
+    service = StateService(bus, {"gripper": 6})
+    settle(service)
+
+    bus.group.registers[ADDR_PRESENT_POSITION] = 2048 + DEFAULT_DEADBANDS["position"] - 1
+    service.poll_once()
+
+    assert service.period == service.idle_period
+
+
+def test_goal_write_returns_to_fast_rate():
+    bus = FakeBus()
+    service = StateService(bus, {"gripper": 6})
+    settle(service)
+
+    for listener in bus.write_listeners:
+        listener(6, ADDR_GOAL_POSITION)
+
+    assert service.period == service.fast_period
@@ -0,0 +1,44 @@
+from collections import namedtuple
+
+from telemetry import TelemetryCollector
+
+Result = namedtuple("Result", ["ok"])
+
+
+class FakeGroup():
+    def isAvailable(self, motor_id, address, length):
+        return True
+
+    def getData(self, motor_id, address, length):
+        return 0
+
+
+class FakeBus():
+    def __init__(self):
+        self.exceptions = []
+
+    def make_sync_read(self, start_address, data_length, motor_ids):
+        return FakeGroup()
+
+    def sync_read(self, group):
+        return Result(ok=True)
+
+    def record_exception(self, message):
+        self.exceptions.append(message)
+
+
+def test_listener_exception_is_recorded_and_other_listeners_still_run():
+    bus = FakeBus()
+    collector = TelemetryCollector(bus, {"gripper": 6})
+    received = []
+
+    def broken(sample):
+        raise RuntimeError("bug")
+
+    collector.add_listener(broken)
+    collector.add_listener(received.append)
+
+    sample = collector.read_once()
+
+    assert received == [sample]
+    assert len(bus.exceptions) == 1 and "RuntimeError" in bus.exceptions[0]